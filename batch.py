@@ -0,0 +1,374 @@
+#!/usr/bin/env python
+
+'''
+Offline batch mode for folders of recorded videos.
+
+Runs a tracker App headless over every video of a set of directories
+and globs, one video per worker of a process pool, and writes into the
+output directory, for every video <name> (its file name without the
+extension):
+
+<name>.jsonl        - the timeline, the tracker record of every tracked
+                      frame with its zone counts, objects and state
+<name>.summary.json - the alert periods, from the debounced zone state of
+                      events.ZoneStateMachine, with their start, end and
+                      worst state in frames and video seconds, the time
+                      spent in every state and the peak counts
+
+and summary.json over all videos. A video is done once its summary is
+written, the timeline going to .part files until then; a run that is
+started again skips the videos that are done and redoes the others.
+
+With --chunks n every video is also cut into n time chunks of whole
+strides, processed concurrently like separate videos. A worker seeks
+to the start of its chunk less the warm-up, tracks the warm-up frames
+without recording them, so the tracks and the zone count history are
+primed, and records its chunk; the chunks are then stitched into one
+timeline, numbered as in a sequential run and with the same detection
+schedule.
+
+Chunked timelines are approximate. The warm-up is at least track_len
+tracked frames, so the zone count history (the last track_len points of
+every track) is complete when the chunk starts recording. But a chunk
+only has the tracks found since its warm-up began, not the older ones a
+sequential run still follows. New corners are masked around the tracks
+it has, so the set of tracks differs from then on and does not converge
+back to the sequential one, however long the warm-up. The counts, and
+with them the events and alert periods, are close to a sequential run's
+but not the same. The summaries of chunked videos therefore say
+approximate: true and list the chunk boundaries, and the report marks
+them with ~. The alert periods are worked out over the stitched
+timeline, so a period spanning chunks stays one.
+
+Usage
+-----
+batch.py [--app <module>] [--out <dir>] [--workers <n>] [--chunks <n>] [--warmup <s>] [--scale <f>]
+         [--adaptive-detect] [--detect-exclude <zones>] [--zone-detect] [--dedup] [--force]
+         <directory or glob> ...
+
+--app <module>     - tracker script whose App and zone profile are used
+                     (default: trackerFront)
+--out <dir>        - output directory (default: batch_out)
+--workers <n>      - videos or chunks processed at once (default: one per core)
+--chunks <n>       - time chunks per video, processed in parallel; the timelines
+                     are then approximate, see above (default: 1)
+--warmup <s>       - seconds tracked before every chunk but the first, at least
+                     track_len tracked frames (default: 2)
+--scale <f>        - track on the gray images resized by f, e.g. 0.5 (default: 1)
+--adaptive-detect  - re-detect features only when tracks or zone coverage are lost,
+                     or every 30 tracked frames
+--detect-exclude <zones>
+                   - never look for new corners in these zones, e.g. free,none
+                     (see tracker.py)
+--zone-detect      - look for new corners only in the danger and warning zones
+--dedup            - drop converged tracks and new corners next to live tracks
+--force            - redo the videos that are done
+'''
+
+# Python 2/3 compatibility
+from __future__ import print_function
+
+import cv2 as cv
+
+# built-in modules
+import os
+import sys
+import glob
+import json
+import time
+import importlib
+import multiprocessing
+
+# local modules
+import events
+import diagnostics
+import zones
+from tracker import write_record
+
+
+VIDEO_EXTENSIONS = ('.avi', '.mp4', '.mkv', '.mov', '.mpg', '.mpeg', '.m4v', '.h264', '.ts')
+
+
+def find_videos(patterns):
+    '''Sorted video files of directories and glob patterns.'''
+    paths = set()
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            names = [os.path.join(pattern, name) for name in os.listdir(pattern)]
+            paths.update(p for p in names if os.path.splitext(p)[1].lower() in VIDEO_EXTENSIONS)
+        else:
+            paths.update(p for p in glob.glob(pattern) if os.path.isfile(p))
+    return sorted(paths)
+
+
+def video_name(path):
+    return os.path.splitext(os.path.basename(path))[0]
+
+
+def summary_path(out, name):
+    return os.path.join(out, name + '.summary.json')
+
+
+def move(src, dst):
+    if os.path.exists(dst):  # os.rename does not replace on Windows
+        os.remove(dst)
+    os.rename(src, dst)
+
+
+def chunk_path(out, name, index):
+    return os.path.join(out, '%s.chunk%03d.jsonl' % (name, index))
+
+
+def write_json(path, data):
+    '''Writes data to path through a temporary file, so path is either complete or absent.'''
+    with open(path + '.part', 'w') as f:
+        json.dump(data, f, indent=2, sort_keys=True)
+    move(path + '.part', path)
+
+
+def alert_periods(records, machine, fps, stride=1):
+    '''Alert periods and seconds per state of the records of one video.
+
+    A period runs from an enter event to the exit back to clear, or to the
+    last record; fps is the frame rate of the video and stride the captured
+    frames per record.
+    '''
+    periods, current = [], None
+    seconds = dict((state, 0.0) for state in events.STATES)
+    step = float(stride) / fps
+    last = None
+    for record in records:
+        for event in machine.update(record):
+            if event['type'] == 'enter':
+                current = dict(start=record['frame'] * stride, state=event['state'],
+                               danger=record['danger'], warning=record['warning'])
+            elif current is not None:
+                if events.STATES.index(event['state']) > events.STATES.index(current['state']):
+                    current['state'] = event['state']
+                if event['state'] == 'clear':
+                    current['end'] = record['frame'] * stride
+                    periods.append(current)
+                    current = None
+        if current is not None:
+            current['danger'] = max(current['danger'], record['danger'])
+            current['warning'] = max(current['warning'], record['warning'])
+        seconds[machine.state] += step
+        last = record
+    if current is not None:
+        current['end'] = last['frame'] * stride
+        current['open'] = True  # still raised at the end of the video
+        periods.append(current)
+    for period in periods:
+        period['start_s'] = period['start'] / fps
+        period['end_s'] = period['end'] / fps
+    return periods, seconds
+
+
+def summarize(path, records, App, fps, elapsed):
+    '''Summary of the timeline of one video.'''
+    tracker = App.params
+    machine = events.ZoneStateMachine(tracker.get('danger_limit', 300), tracker.get('warning_limit', 175))
+    periods, seconds = alert_periods(records, machine, fps, App.stride)
+    frames = len(records)
+    return dict(video=path,
+                frames=frames,
+                fps=fps,
+                seconds=frames * App.stride / fps,
+                elapsed=elapsed,
+                speed=frames / elapsed if elapsed > 0 else None,
+                max_danger=max([r['danger'] for r in records] or [0]),
+                max_warning=max([r['warning'] for r in records] or [0]),
+                state_seconds=seconds,
+                alerts=periods)
+
+
+def probe(path):
+    '''Frame rate and frame count of a video file, None when it cannot be opened.'''
+    cap = cv.VideoCapture(path)
+    if not cap.isOpened():
+        return None
+    fps = cap.get(cv.CAP_PROP_FPS) or 30.0
+    count = int(cap.get(cv.CAP_PROP_FRAME_COUNT))
+    cap.release()
+    return fps, count
+
+
+def plan_chunks(count, chunks, stride, warmup):
+    '''(index, first, end, begin) of the chunks of a video of count frames: the chunk records
+    the frames first to end (None for the end of the video) and starts tracking at begin.
+    '''
+    size = max(1, -(-count // (chunks * stride))) * stride  # whole strides
+    plan = []
+    for index in range(chunks):
+        first = index * size
+        if index > 0 and first >= count:
+            break
+        end = first + size if index < chunks - 1 and first + size < count else None
+        begin = max(0, first - warmup) // stride * stride
+        plan.append((index, first, end, begin))
+        if end is None:
+            break
+    return plan
+
+
+def process_chunk(job):
+    '''Tracks the frames first to end of a video headless into a chunk timeline, after
+    tracking the warm-up from begin unrecorded. Returns the chunk and its time, or the error.
+    '''
+    path, out, app, options, cv_threads, (index, first, end, begin) = job
+    try:
+        cv.setNumThreads(cv_threads)
+        App = importlib.import_module(app).App
+        stride = App.stride
+        start = time.time()
+        sink = diagnostics.Sink(sys.stderr, diagnostics.OFF)
+        # opened here rather than by create_capture, which would split the path at a ':'
+        cap = cv.VideoCapture(path)
+        if not cap.isOpened():
+            raise IOError('unable to open video source: %s' % path)
+        if begin > 0:
+            cap.set(cv.CAP_PROP_POS_FRAMES, begin)
+        runner = App(cap, headless=True, records=None, prefetch=2, sink=sink, **options)
+        tracker = runner.tracker
+        tracker.frame_idx = begin // stride  # numbering and detection schedule of a sequential run
+        part = chunk_path(out, video_name(path), index)
+        try:
+            with open(part + '.part', 'w') as f:
+                while end is None or tracker.frame_idx * stride < end:
+                    ret, frame = runner.cam.read()
+                    if frame is None:
+                        break
+                    record = tracker.process(frame)
+                    if record['frame'] * stride >= first:
+                        write_record(f, record)
+        finally:
+            runner.cam.release()
+        move(part + '.part', part)
+        return dict(video=path, chunk=index, elapsed=time.time() - start)
+    except Exception as e:
+        return dict(video=path, chunk=index, error='%s: %s' % (type(e).__name__, e))
+
+
+def stitch(path, out, app, chunks, fps, elapsed):
+    '''Joins the chunk timelines of a video into its timeline and writes its summary.'''
+    App = importlib.import_module(app).App
+    name = video_name(path)
+    timeline = os.path.join(out, name + '.jsonl')
+    records, boundaries = [], []
+    with open(timeline + '.part', 'w') as f:
+        for index in range(chunks):
+            if index > 0 and records:
+                boundaries.append(records[-1]['frame'] + 1)
+            with open(chunk_path(out, name, index)) as chunk:
+                for line in chunk:
+                    f.write(line)
+                    records.append(json.loads(line))
+    summary = summarize(path, records, App, fps, elapsed)
+    summary['chunks'] = chunks
+    # the tracks after a boundary differ from a sequential run, see the module docstring
+    summary['approximate'] = chunks > 1
+    summary['boundaries'] = boundaries
+    move(timeline + '.part', timeline)
+    for index in range(chunks):
+        os.remove(chunk_path(out, name, index))
+    write_json(summary_path(out, name), summary)
+    return summary
+
+
+def print_summary(s):
+    if 'error' in s:
+        print('%-30s failed, %s' % (video_name(s['video']), s['error']))
+    else:
+        print('%-30s %7d %8.1f %7.1f %6d %8.1f %8.1f%s' % (
+            video_name(s['video']), s['frames'], s['seconds'], s['speed'] or 0, len(s['alerts']),
+            s['state_seconds']['warning'], s['state_seconds']['danger'], ' ~' if s.get('approximate') else ''))
+    sys.stdout.flush()
+
+
+def main():
+    import getopt
+    args, patterns = getopt.getopt(sys.argv[1:], '', ['app=', 'out=', 'workers=', 'chunks=', 'warmup=', 'scale=',
+                                                      'adaptive-detect', 'detect-exclude=', 'zone-detect', 'dedup',
+                                                      'force'])
+    args = dict(args)
+    if not patterns:
+        print(__doc__)
+        sys.exit(1)
+    out = args.get('--out', 'batch_out')
+    app = args.get('--app', 'trackerFront')
+    workers = int(args.get('--workers', multiprocessing.cpu_count()))
+    chunks = int(args.get('--chunks', 1))
+    warmup = float(args.get('--warmup', 2.0))
+    options = dict(scale=float(args.get('--scale', 1.0)), adaptive_detect='--adaptive-detect' in args,
+                   detect_exclude=zones.labels_of(args.get('--detect-exclude', '')),
+                   zone_detect='--zone-detect' in args, dedup='--dedup' in args)
+
+    videos = find_videos(patterns)
+    names = [video_name(p) for p in videos]
+    if len(set(names)) < len(names):
+        raise ValueError('videos of the same name would share their output files')
+    if not os.path.isdir(out):
+        os.makedirs(out)
+    done = [p for p in videos if os.path.exists(summary_path(out, video_name(p)))]
+    todo = videos if '--force' in args else [p for p in videos if p not in done]
+    print('%d videos, %d done, %d to process on %d workers' % (len(videos), len(videos) - len(todo),
+                                                              len(todo), workers))
+
+    print('%-30s %7s %8s %7s %6s %8s %8s' % ('video', 'frames', 'seconds', 'fps', 'alerts', 'warning', 'danger'))
+    failed = 0
+    App = importlib.import_module(app).App
+    stride = App.stride
+    # the count history needs track_len tracked frames
+    least = App.params.get('track_len', 10) * stride
+    plans, jobs = {}, []
+    for path in todo:
+        found = probe(path)
+        if found is None:
+            print_summary(dict(video=path, error='cannot open'))
+            failed += 1
+            continue
+        fps, count = found
+        plan = plan_chunks(count, chunks, stride, max(least, int(round(warmup * fps))))
+        plans[path] = dict(fps=fps, chunks=len(plan), left=len(plan), elapsed=0.0, error=None)
+        jobs += [(path, out, app, options, chunk) for chunk in plan]
+
+    # the workers split the cores, so they do not each start a full OpenCV thread pool
+    cv_threads = max(1, multiprocessing.cpu_count() // max(1, min(workers, len(jobs))))
+    jobs = [(path, out, app, options, cv_threads, chunk) for path, out, app, options, chunk in jobs]
+    pool = multiprocessing.Pool(workers, maxtasksperchild=1)
+    try:
+        for result in pool.imap_unordered(process_chunk, jobs):
+            plan = plans[result['video']]
+            plan['left'] -= 1
+            plan['elapsed'] += result.get('elapsed', 0.0)
+            plan['error'] = plan['error'] or result.get('error')
+            if plan['left'] > 0:
+                continue
+            if plan['error'] is not None:
+                summary = dict(video=result['video'], error=plan['error'])
+            else:
+                summary = stitch(result['video'], out, app, plan['chunks'], plan['fps'], plan['elapsed'])
+            print_summary(summary)
+            failed += 'error' in summary
+    finally:
+        pool.terminate()
+        pool.join()
+
+    summaries = []
+    for path in videos:
+        if os.path.exists(summary_path(out, video_name(path))):
+            with open(summary_path(out, video_name(path))) as f:
+                summaries.append(json.load(f))
+    write_json(os.path.join(out, 'summary.json'), dict(
+        app=app, options=options, chunks=chunks, warmup=warmup, videos=len(videos), done=len(summaries), failed=failed,
+        approximate=any(s.get('approximate') for s in summaries),
+        seconds=sum(s['seconds'] for s in summaries),
+        alerts=sum(len(s['alerts']) for s in summaries),
+        state_seconds=dict((state, sum(s['state_seconds'][state] for s in summaries)) for state in events.STATES),
+        summaries=dict((video_name(s['video']), dict(s, alerts=len(s['alerts']))) for s in summaries)))
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,238 @@
+#!/usr/bin/env python
+
+'''
+Tracker throughput benchmark.
+
+Runs the headless loop of the tracker Apps over fixed-seed synthetic
+video (the synth: sources of video.create_capture: plain noise, Chess,
+the TestSceneRender based scene, Book and Cube) and reports, per
+configuration:
+
+fps         - tracked frames per second, capture excluded
+p50/p95/p99 - work of the App loop per tracked frame in ms: tracking, the
+              zone events, the headless record and the latency controller,
+              as App.control() is given it; nothing is drawn, every
+              configuration runs headless
+capture     - mean ms per tracked frame spent reading the synthetic source,
+              the grabs of the frames its stride skips included
+rss         - peak resident memory of the configuration in MB
+tracks      - mean number of tracks per frame, the same on every run
+              as long as the tracking itself is unchanged
+detect      - share of the frames that ran feature detection
+
+Every configuration runs in a fresh process, so the peak RSS is its own.
+Book and Cube need the OpenCV sample images and are skipped without them.
+
+Usage
+-----
+bench.py [--frames <n>] [--only <name>,...] [--threads <n>] [--save <file>]
+         [--baseline <file>] [--threshold <f>]
+
+--frames <n>       - frames per configuration (default: 150)
+--only <name>,...  - run only these configurations
+--threads <n>      - cv.setNumThreads for every run (default: OpenCV's choice)
+--save <file>      - store the results as a JSON baseline
+--baseline <file>  - compare with a stored baseline, exit 1 on a regression
+--threshold <f>    - allowed relative regression of fps, p95 and rss (default: 0.1)
+'''
+
+# Python 2/3 compatibility
+from __future__ import print_function
+
+import numpy as np
+import cv2 as cv
+
+# built-in modules
+import sys
+import json
+import time
+import multiprocessing
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# local modules
+import diagnostics
+import trackerFront
+import trackerSide
+import lk_track
+import front_lk
+
+
+SEED = 1
+
+CHESS = 'synth:class=chess:noise=0.05:size=1280x720:seed=%d' % SEED
+SCENE = 'synth:class=scene:noise=0.05:size=1280x720:seed=%d' % SEED
+
+# name, App, video source, App options
+configurations = [
+    ('front-noise',          trackerFront.App, 'synth:noise=0.1:size=1280x720:seed=%d' % SEED, {}),
+    ('front-chess',          trackerFront.App, CHESS, {}),
+    ('front-chess-half',     trackerFront.App, CHESS, dict(scale=0.5)),
+    ('front-chess-adaptive', trackerFront.App, CHESS, dict(adaptive_detect=True)),
+    ('front-chess-zones',    trackerFront.App, CHESS, dict(zone_detect=True)),
+    ('front-chess-dedup',    trackerFront.App, CHESS, dict(dedup=True)),
+    ('front-chess-budget',   trackerFront.App, CHESS, dict(budget=25)),
+    ('side-scene',           trackerSide.App,  SCENE, {}),
+    ('side-scene-adaptive',  trackerSide.App,  SCENE, dict(adaptive_detect=True)),
+    ('side-scene-zones',     trackerSide.App,  SCENE, dict(zone_detect=True)),
+    ('side-scene-dedup',     trackerSide.App,  SCENE, dict(dedup=True)),
+    ('near-scene',           lk_track.App,     SCENE, {}),
+    ('front_lk-scene',       front_lk.App,     SCENE, {}),
+    ('front-book',           trackerFront.App, 'synth:class=book:noise=0.05:seed=%d' % SEED, {}),
+    ('front-cube',           trackerFront.App, 'synth:class=cube:noise=0.05:seed=%d' % SEED, {}),
+]
+
+# metric, +1 when higher is better, -1 when lower is better
+checked = [('fps', 1), ('p95', -1), ('rss', -1)]
+
+
+def peak_rss():
+    '''Peak resident memory of this process in MB, None where unknown.'''
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / 1024.0 ** (2 if sys.platform == 'darwin' else 1)  # bytes on macOS, KB elsewhere
+
+
+class Records(object):
+    '''Stands in for the headless records file, keeping the track counts.'''
+    def __init__(self):
+        self.tracks = []
+
+    def write(self, line):
+        self.tracks.append(json.loads(line)['tracks'])
+
+
+def measured(App):
+    '''App timing the capture and the work of every frame of its run loop.'''
+    class Measured(App):
+        frames = None   # tracked frames to run
+
+        def read(self):
+            if len(self.capture) >= self.frames:
+                return False, None
+            start = time.time()
+            result = App.read(self)
+            self.capture.append(time.time() - start)
+            return result
+
+        def control(self, busy, frames):
+            self.latency.append(busy)
+            App.control(self, busy, frames)
+    return Measured
+
+
+def run_configuration(App, source, options, frames, threads=None):
+    '''Runs App headless over frames frames of source; returns the result dict,
+    or None when the source cannot be opened.
+    '''
+    if threads is not None:
+        cv.setNumThreads(threads)
+    np.random.seed(SEED)
+    records = Records()
+    app = measured(App)(source, headless=True, records=records, sink=diagnostics.Sink(level=diagnostics.OFF),
+                        **options)
+    if app.cam is None or not app.cam.isOpened():
+        return None
+    app.frames, app.capture, app.latency = frames, [], []
+    app.run()
+    latency, capture, tracks = app.latency, app.capture, records.tracks
+    if not latency:
+        return None
+    latency = np.float64(latency) * 1000
+    p50, p95, p99 = np.percentile(latency, [50, 95, 99])
+    return dict(frames=len(latency),
+                fps=len(latency) / (latency.sum() / 1000),
+                p50=p50, p95=p95, p99=p99,
+                capture=np.mean(capture) * 1000,
+                rss=peak_rss(),
+                tracks=float(np.mean(tracks)),
+                detect=app.tracker.scheduler.stats()['rate'])
+
+
+def _worker(args, out):
+    try:
+        out.put(run_configuration(*args))
+    except Exception as e:
+        out.put(dict(error='%s: %s' % (type(e).__name__, e)))
+
+
+def run_isolated(*args):
+    '''run_configuration in a fresh process, so peak RSS is measured per configuration.'''
+    out = multiprocessing.Queue()
+    p = multiprocessing.Process(target=_worker, args=(args, out))
+    p.start()
+    result = out.get()
+    p.join()
+    return result
+
+
+def compare(results, baseline, threshold):
+    '''Returns the list of (name, metric, base, now) regressed by more than threshold.'''
+    regressions = []
+    for name, result in sorted(results.items()):
+        base = baseline.get(name)
+        if base is None:
+            continue
+        for metric, sign in checked:
+            if result.get(metric) is None or base.get(metric) is None:
+                continue
+            change = sign * (result[metric] - base[metric]) / base[metric]
+            if change < -threshold:
+                regressions.append((name, metric, base[metric], result[metric]))
+    return regressions
+
+
+def print_result(name, r):
+    if r is None:
+        print('%-20s skipped, source not available' % name)
+    elif 'error' in r:
+        print('%-20s failed, %s' % (name, r['error']))
+    else:
+        print('%-20s %6d %8.1f %7.2f %7.2f %7.2f %8.2f %7s %7.1f %7.2f' % (
+            name, r['frames'], r['fps'], r['p50'], r['p95'], r['p99'], r['capture'],
+            '-' if r['rss'] is None else '%.0f' % r['rss'], r['tracks'], r['detect']))
+    sys.stdout.flush()
+
+
+def main():
+    import getopt
+    args, _ = getopt.getopt(sys.argv[1:], '', ['frames=', 'only=', 'threads=', 'save=', 'baseline=', 'threshold='])
+    args = dict(args)
+    frames = int(args.get('--frames', 150))
+    threads = int(args['--threads']) if '--threads' in args else None
+    threshold = float(args.get('--threshold', 0.1))
+    only = args['--only'].split(',') if '--only' in args else None
+
+    print('%-20s %6s %8s %7s %7s %7s %8s %7s %7s %7s' % (
+        'configuration', 'frames', 'fps', 'p50 ms', 'p95 ms', 'p99 ms', 'capture', 'rss MB', 'tracks', 'detect'))
+    results = {}
+    for name, App, source, options in configurations:
+        if only is not None and name not in only:
+            continue
+        r = run_isolated(App, source, options, frames, threads)
+        print_result(name, r)
+        if r is not None and 'error' not in r:
+            results[name] = r
+
+    if '--save' in args:
+        with open(args['--save'], 'w') as f:
+            json.dump(dict(frames=frames, results=results), f, indent=2, sort_keys=True)
+
+    if '--baseline' in args:
+        with open(args['--baseline']) as f:
+            baseline = json.load(f)
+        if baseline.get('frames') != frames:
+            print('Warning: baseline was taken with %s frames per configuration' % baseline.get('frames'))
+        regressions = compare(results, baseline['results'], threshold)
+        for name, metric, base, now in regressions:
+            print('REGRESSION %s %s: %.2f -> %.2f' % (name, metric, base, now))
+        if regressions:
+            sys.exit(1)
+        print('no regression beyond %.0f%%' % (threshold * 100))
+
+
+if __name__ == '__main__':
+    main()
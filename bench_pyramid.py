@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+
+'''
+Optical flow pyramid benchmark.
+
+Times the forward-backward LK step of the trackers two ways for
+maxLevel 2 and up:
+
+builtin - calcOpticalFlowPyrLK on plain images, which rebuilds both
+          pyramids inside every call (four builds per frame)
+reused  - every frame's pyramid built once and shared by the forward,
+          backward and next frame calls (pyramid_lk)
+
+The trackers use builtin: reused came out slower at every maxLevel
+tried, the per-level calls recompute the image derivatives the shared
+pyramid was meant to save.
+
+Usage
+-----
+bench_pyramid.py [--frames <n>] [--levels <l>,<l>,...] [<video_source>]
+
+Without a video source a fixed-seed 1280x720 texture pans across the
+frame, so runs are comparable between machines.
+'''
+
+# Python 2/3 compatibility
+from __future__ import print_function
+
+import numpy as np
+import cv2 as cv
+
+# built-in modules
+import sys
+import time
+
+# local modules
+import video
+import tracker
+
+
+def build_pyramid(img, levels):
+    '''Gaussian pyramid [img, img/2, ...] with levels+1 entries.'''
+    pyramid = [img]
+    for _ in range(levels):
+        pyramid.append(cv.pyrDown(pyramid[-1]))
+    return pyramid
+
+
+def pyramid_lk(pyr0, pyr1, points, lk_params):
+    '''calcOpticalFlowPyrLK over prebuilt pyramids.
+
+    The Python bindings do not accept the output of buildOpticalFlowPyramid,
+    so the coarse to fine search is run here one level at a time, seeding
+    every level with twice the flow of the level above. The points come out
+    identical to calcOpticalFlowPyrLK(pyr0[0], pyr1[0], points, None, **lk_params).
+    '''
+    levels = min(lk_params.get('maxLevel', 3), len(pyr0) - 1, len(pyr1) - 1)
+    params = dict(lk_params, maxLevel=0, flags=cv.OPTFLOW_USE_INITIAL_FLOW)
+    points = np.float32(points).reshape(-1, 1, 2)
+    found = points / (1 << levels)
+    for level in range(levels, -1, -1):
+        if level < levels:
+            found = found * 2
+        found, status, err = cv.calcOpticalFlowPyrLK(pyr0[level], pyr1[level], points / (1 << level),
+                                                     np.float32(found), **params)
+    return found, status, err
+
+
+def panning_frames(n, size=(1280, 720), seed=0):
+    w, h = size
+    rng = np.random.RandomState(seed)
+    texture = cv.GaussianBlur(np.uint8(rng.rand(h + 2*n + 1, w + 3*n + 1) * 255), (7, 7), 0)
+    return [texture[2*i:2*i+h, 3*i:3*i+w].copy() for i in range(n)]
+
+
+def source_frames(src, n):
+    cam = video.create_capture(src, None)
+    frames = []
+    while len(frames) < n:
+        ret, frame = cam.read()
+        if frame is None:
+            break
+        frames.append(cv.cvtColor(frame, cv.COLOR_BGR2GRAY))
+    return frames
+
+
+def run_builtin(frames, p0, lk_params):
+    for img0, img1 in zip(frames, frames[1:]):
+        p1, _st, _err = cv.calcOpticalFlowPyrLK(img0, img1, p0, None, **lk_params)
+        cv.calcOpticalFlowPyrLK(img1, img0, p1, None, **lk_params)
+    return p1
+
+
+def run_reused(frames, p0, lk_params):
+    levels = lk_params['maxLevel']
+    pyr0 = build_pyramid(frames[0], levels)
+    for img1 in frames[1:]:
+        pyr1 = build_pyramid(img1, levels)
+        p1, _st, _err = pyramid_lk(pyr0, pyr1, p0, lk_params)
+        pyramid_lk(pyr1, pyr0, p1, lk_params)
+        pyr0 = pyr1
+    return p1
+
+
+def timed(f, *args):
+    start = time.time()
+    result = f(*args)
+    return time.time() - start, result
+
+
+def main():
+    import getopt
+    args, sources = getopt.getopt(sys.argv[1:], '', ['frames=', 'levels='])
+    args = dict(args)
+    n = int(args.get('--frames', 60))
+    levels = [int(l) for l in args.get('--levels', '2,3,4').split(',')]
+
+    frames = source_frames(sources[0], n) if sources else panning_frames(n)
+    p0 = cv.goodFeaturesToTrack(frames[0], mask=None, **tracker.feature_params)
+    steps = len(frames) - 1
+    print('%d frames of %dx%d, %d points' % (len(frames), frames[0].shape[1], frames[0].shape[0], len(p0)))
+    print('maxLevel   builtin ms/frame   reused ms/frame   saving   max |dp|')
+    for level in levels:
+        lk_params = dict(tracker.lk_params, maxLevel=level)
+        run_builtin(frames[:3], p0, lk_params)  # warm up
+        t_builtin, p_builtin = timed(run_builtin, frames, p0, lk_params)
+        t_reused, p_reused = timed(run_reused, frames, p0, lk_params)
+        print('%8d   %16.2f   %15.2f   %5.1f%%   %8.3g' % (
+            level, t_builtin / steps * 1000, t_reused / steps * 1000,
+            100.0 * (t_builtin - t_reused) / t_builtin, np.abs(p_builtin - p_reused).max()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+
+'''
+Objects in the danger and warning zones.
+
+The points of the zones are binned into a grid of cell x cell pixel
+squares and the occupied cells are joined into 8-connected components,
+one per object: points up to about two cells apart belong together,
+points further apart make separate objects. Every object gets the
+centroid and bounding box of its points, their number and its zone,
+danger as soon as one of its points is in the danger zone.
+
+Binning, the components of the small cell grid and the per-object sums
+are all linear in the number of points, a few thousand points take well
+under a millisecond.
+'''
+
+# Python 2/3 compatibility
+from __future__ import print_function
+
+import numpy as np
+import cv2 as cv
+
+# local modules
+import zones
+
+
+def find_objects(xs, ys, zone, shape, cell=32, min_points=1):
+    '''Objects among the zone points (xs, ys) of a frame of shape (h, w).
+
+    xs, ys, zone: integer coordinates and labels, as zones.classify returns them
+    min_points: smaller groups of points are left out
+    Returns the centers (k, 2) float, boxes (k, 4) int as x0, y0, x1, y1
+    inclusive, point counts and zone labels of the k objects, most points first.
+    '''
+    on_zones = (zone == zones.DANGER) | (zone == zones.WARNING)
+    xs, ys, zone = xs[on_zones], ys[on_zones], zone[on_zones]
+    if len(xs) == 0:
+        return np.zeros((0, 2)), np.zeros((0, 4), np.intp), np.zeros(0, np.intp), np.zeros(0, np.int8)
+    h, w = shape
+    gh, gw = (h + cell - 1) // cell, (w + cell - 1) // cell
+    cells = (ys // cell) * gw + xs // cell
+    occupied = np.uint8(np.bincount(cells, minlength=gh * gw) > 0).reshape(gh, gw)
+    n, grid = cv.connectedComponents(occupied, connectivity=8, ltype=cv.CV_32S)
+    k = n - 1  # component 0 is the empty cells
+    label = grid.ravel()[cells] - 1
+
+    counts = np.bincount(label, minlength=k)
+    centers = np.column_stack([np.bincount(label, xs, k), np.bincount(label, ys, k)]) / counts[:, np.newaxis]
+    danger = np.bincount(label, zone == zones.DANGER, k) > 0
+    boxes = np.empty((k, 4), np.intp)
+    boxes[:, :2] = np.iinfo(np.intp).max
+    boxes[:, 2:] = -1
+    np.minimum.at(boxes[:, 0], label, xs)
+    np.minimum.at(boxes[:, 1], label, ys)
+    np.maximum.at(boxes[:, 2], label, xs)
+    np.maximum.at(boxes[:, 3], label, ys)
+
+    keep = np.nonzero(counts >= min_points)[0]
+    keep = keep[np.argsort(-counts[keep], kind='stable')]
+    labels = np.where(danger, zones.DANGER, zones.WARNING).astype(np.int8)
+    return centers[keep], boxes[keep], counts[keep], labels[keep]
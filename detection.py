@@ -0,0 +1,227 @@
+#!/usr/bin/env python
+
+'''
+Feature re-detection of the zone trackers.
+
+DetectionScheduler decides on which frames goodFeaturesToTrack runs.
+The fixed schedule is the original one, every interval-th frame. The
+adaptive schedule detects only when tracking needs it:
+
+start    - there are no tracks at all
+tracks   - the track count fell below refill times the count right after
+           the last detection (or below an absolute target_tracks)
+coverage - the share of danger and warning zone cells holding a tracked
+           point fell below refill times its value after the last
+           detection; the zones are cut into cell x cell pixel squares
+interval - max_interval frames passed since the last detection
+
+and never sooner than min_interval frames after the last one. Every
+fired detection is counted by its reason in counters.
+
+MaskBuilder makes the goodFeaturesToTrack mask that keeps new corners
+away from the live tracks, without a cv.circle call per track.
+
+ZoneDetector looks for corners only inside the danger and warning zones:
+goodFeaturesToTrack runs on the crop of their bounding box, masked by the
+zone raster, and every zone is topped up with its strongest corners to
+at most its quota of live tracks. No corner budget is spent on sky, road
+or the free zone and the LK work is bounded by the quotas.
+'''
+
+# Python 2/3 compatibility
+from __future__ import print_function
+
+import numpy as np
+import cv2 as cv
+
+# local modules
+import zones
+
+
+REASONS = ('start', 'tracks', 'coverage', 'interval')
+
+
+class DetectionScheduler(object):
+    def __init__(self, interval=5, adaptive=False, max_interval=30, refill=0.8, target_tracks=None,
+                 min_interval=2, cell=32):
+        self.interval = interval            # period of the fixed schedule
+        self.adaptive = adaptive
+        self.max_interval = max_interval
+        self.refill = refill
+        self.target_tracks = target_tracks
+        self.min_interval = min_interval
+        self.cell = cell
+        self.frames = 0
+        self.counters = dict((reason, 0) for reason in REASONS)
+        self.last = None                    # frame of the last detection
+        self.base_tracks = self.base_coverage = None
+        self.zone_cells = None
+
+    def set_zones(self, labels, cell=None):
+        '''Cuts the danger and warning zones of a label raster into coverage cells.'''
+        if cell is not None:
+            self.cell = cell
+        c = self.cell
+        h, w = labels.shape
+        gh, gw = (h + c - 1) // c, (w + c - 1) // c
+        on_zones = np.zeros((gh * c, gw * c), bool)
+        on_zones[:h, :w] = (labels == zones.DANGER) | (labels == zones.WARNING)
+        # a cell counts when at least half of it is zone
+        share = on_zones.reshape(gh, c, gw, c).mean(axis=(1, 3))
+        self.grid = (gh, gw)
+        self.zone_cells = (share >= 0.5).ravel()
+        self.base_tracks = self.base_coverage = None
+
+    def coverage(self, zone, xs, ys):
+        '''Share of the zone cells holding at least one danger or warning point.'''
+        if self.zone_cells is None or not self.zone_cells.any():
+            return 1.0
+        on_zones = (zone == zones.DANGER) | (zone == zones.WARNING)
+        c = self.cell
+        cells = (ys[on_zones] // c) * self.grid[1] + xs[on_zones] // c
+        covered = np.bincount(cells, minlength=len(self.zone_cells))[:len(self.zone_cells)] > 0
+        return float(covered[self.zone_cells].sum()) / self.zone_cells.sum()
+
+    def due(self, frame_idx, n_tracks, zone=None, xs=None, ys=None):
+        '''Reason to detect on frame_idx, None to skip it. Counts the detection it allows.'''
+        self.frames += 1
+        reason = self._reason(frame_idx, n_tracks, zone, xs, ys)
+        if reason is not None:
+            self.counters[reason] += 1
+            self.last = frame_idx
+            self.base_tracks = None  # taken again on the next frame
+        return reason
+
+    def _reason(self, frame_idx, n_tracks, zone, xs, ys):
+        if not self.adaptive:
+            return 'interval' if frame_idx % self.interval == 0 else None
+        if n_tracks == 0 or self.last is None:
+            return 'start'
+        since = frame_idx - self.last
+        if since >= self.max_interval:
+            return 'interval'
+        covered = self.coverage(zone, xs, ys) if zone is not None else None
+        if self.base_tracks is None:
+            # first frame after a detection: what tracking starts from
+            self.base_tracks, self.base_coverage = n_tracks, covered
+            return None
+        if since < self.min_interval:
+            return None
+        target = self.target_tracks if self.target_tracks is not None else self.refill * self.base_tracks
+        if n_tracks < target:
+            return 'tracks'
+        if covered is not None and self.base_coverage and covered < self.refill * self.base_coverage:
+            return 'coverage'
+        return None
+
+    @property
+    def fired(self):
+        return sum(self.counters.values())
+
+    def stats(self):
+        '''Detections by reason, their total and the share of frames that detected.'''
+        return dict(self.counters, fired=self.fired, frames=self.frames,
+                    rate=float(self.fired) / self.frames if self.frames else 0.0)
+
+
+def disc_kernel(radius):
+    '''uint8 (2r+1, 2r+1) kernel of the pixels a filled cv.circle of that radius covers.'''
+    kernel = np.zeros((2 * radius + 1, 2 * radius + 1), np.uint8)
+    cv.circle(kernel, (radius, radius), radius, 1, -1)
+    return kernel
+
+
+class MaskBuilder(object):
+    '''Detection mask of frames of size (w, h): 255 where corners may be found.
+
+    build(points) blanks the same disc of radius around every point that
+    cv.circle(mask, point, radius, 0, -1) did, pixel for pixel. The discs
+    are stamped into a preallocated buffer all at once, written directly
+    while they are few and through a single cv.dilate of the centre
+    pixels with the disc kernel when there are many. The labels listed in
+    exclude (e.g. zones.FREE and zones.NONE) are blanked from the start.
+    '''
+    scatter_limit = 100000  # disc pixels written directly, beyond that the dilation is cheaper
+
+    def __init__(self, size, radius, labels=None, exclude=()):
+        w, h = size
+        self.size = size
+        self.radius = r = radius
+        self.pad = pad = 2 * r  # room for the discs of points up to r outside the frame
+        self.kernel = disc_kernel(r)
+        dy, dx = np.nonzero(self.kernel)
+        self.dy, self.dx = dy - r, dx - r
+        self.base = np.full((h, w), 255, np.uint8)
+        if labels is not None and len(exclude) > 0:
+            self.base[np.isin(labels, exclude)] = 0
+        self.stamps = np.zeros((h + 2 * pad, w + 2 * pad), np.uint8)
+        self.covered = np.zeros_like(self.stamps)
+        self.mask = np.empty((h, w), np.uint8)
+
+    def build(self, points):
+        '''The mask for tracks ending at points; the buffer is reused by the next call.'''
+        w, h = self.size
+        r, pad = self.radius, self.pad
+        np.copyto(self.mask, self.base)
+        p = np.int32(points).reshape(-1, 2)  # truncated, like the cv.circle centres were
+        near = (p[:, 0] >= -r) & (p[:, 0] < w + r) & (p[:, 1] >= -r) & (p[:, 1] < h + r)
+        p = p[near] + pad
+        if len(p) == 0:
+            return self.mask
+        self.stamps[:] = 0
+        if len(p) * len(self.dy) <= self.scatter_limit:
+            self.stamps[(p[:, 1, np.newaxis] + self.dy).ravel(), (p[:, 0, np.newaxis] + self.dx).ravel()] = 255
+            covered = self.stamps
+        else:
+            self.stamps[p[:, 1], p[:, 0]] = 255
+            covered = cv.dilate(self.stamps, self.kernel, dst=self.covered)
+        cv.subtract(self.mask, covered[pad:pad + h, pad:pad + w], dst=self.mask)
+        return self.mask
+
+
+class ZoneDetector(object):
+    '''goodFeaturesToTrack over the danger and warning zones of a label raster.
+
+    quotas: {label: most live tracks} for zones.DANGER and zones.WARNING,
+    by default feature_params['maxCorners'] split by the zone areas.
+    '''
+    def __init__(self, labels, feature_params, quotas=None):
+        labels = np.asarray(labels)
+        on_zones = (labels == zones.DANGER) | (labels == zones.WARNING)
+        ys, xs = np.nonzero(on_zones)
+        self.box = None
+        if len(xs) == 0:
+            return
+        x0, y0, x1, y1 = int(xs.min()), int(ys.min()), int(xs.max()) + 1, int(ys.max()) + 1
+        self.box = (x0, y0, x1, y1)
+        self.labels = np.array(labels[y0:y1, x0:x1])
+        self.zone_mask = np.where(on_zones[y0:y1, x0:x1], 255, 0).astype(np.uint8)
+        self.mask = np.empty_like(self.zone_mask)
+        if quotas is None:
+            area = np.bincount(self.labels[self.labels > 0], minlength=zones.WARNING + 1)
+            total = feature_params['maxCorners']
+            quotas = dict((z, int(round(total * float(area[z]) / area.sum()))) for z in (zones.DANGER, zones.WARNING))
+        self.quotas = quotas
+        # the quotas cut the corners per zone, goodFeaturesToTrack itself is not limited
+        self.params = dict(feature_params, maxCorners=0)
+
+    def detect(self, gray, mask=None, tracked=None):
+        '''Corners of gray inside the zones and mask as (n, 2) float32, strongest first, or None.
+        tracked: {label: live tracks in that zone}, which use up its quota
+        '''
+        if self.box is None:
+            return None
+        x0, y0, x1, y1 = self.box
+        if mask is None:
+            zone_mask = self.zone_mask
+        else:
+            zone_mask = cv.bitwise_and(mask[y0:y1, x0:x1], self.zone_mask, dst=self.mask)
+        p = cv.goodFeaturesToTrack(gray[y0:y1, x0:x1], mask=zone_mask, **self.params)
+        if p is None:
+            return None
+        p = p.reshape(-1, 2)
+        found = self.labels[np.int32(p[:, 1]), np.int32(p[:, 0])]
+        tracked = tracked or {}
+        keep = np.concatenate([np.nonzero(found == z)[0][:max(0, q - tracked.get(z, 0))]
+                               for z, q in sorted(self.quotas.items())])
+        return p[np.sort(keep)] + np.float32([x0, y0])
@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+
+'''
+Non-blocking diagnostics for the tracking loop.
+
+Sink.log() neither formats nor waits: the message goes into
+a bounded queue that a background thread drains to the output stream,
+so a slow terminal or a journal on a busy disk cannot stall frame
+processing. When the queue is full the message is dropped and counted.
+
+Every message has a key; messages of the same key come out at most once
+per interval seconds, the ones in between are counted and reported with
+the next one that passes. Levels:
+
+off   - nothing is queued
+info  - per-frame diagnostics, rate limited (default)
+debug - everything, still rate limited
+'''
+
+# Python 2/3 compatibility
+from __future__ import print_function
+
+# built-in modules
+import sys
+import time
+import threading
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+
+OFF, INFO, DEBUG = 0, 1, 2
+LEVELS = dict(off=OFF, info=INFO, debug=DEBUG)
+
+
+class Sink(object):
+    def __init__(self, out=sys.stdout, level=INFO, interval=1.0, queue_size=256):
+        self.out = out
+        self.level = level
+        self.interval = interval  # seconds between two messages of one key
+        self.messages = queue.Queue(maxsize=queue_size)
+        self.last = {}            # key -> time of its last message
+        self.suppressed = {}      # key -> messages held back by the rate limit
+        self.dropped = 0          # messages lost to a full queue
+        self.thread = None
+
+    def log(self, key, fmt, *args, **kw):
+        '''Queues fmt % args, formatted on the background thread.'''
+        level = kw.get('level', INFO)
+        if level > self.level:
+            return
+        now = time.time()
+        if now - self.last.get(key, -self.interval) < self.interval:
+            self.suppressed[key] = self.suppressed.get(key, 0) + 1
+            return
+        self.last[key] = now
+        if self.thread is None:
+            self._start()
+        try:
+            self.messages.put_nowait((fmt, args, self.suppressed.pop(key, 0)))
+        except queue.Full:
+            self.dropped += 1
+
+    def debug(self, key, fmt, *args):
+        self.log(key, fmt, *args, level=DEBUG)
+
+    def _start(self):
+        self.thread = threading.Thread(target=self._writer)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _writer(self):
+        while True:
+            item = self.messages.get()
+            if item is None:
+                break
+            fmt, args, suppressed = item
+            line = fmt % args
+            if suppressed:
+                line += ' (+%d suppressed)' % suppressed
+            try:
+                self.out.write(line + '\n')
+                self.out.flush()
+            except (IOError, ValueError):  # closed or broken output, keep the tracker running
+                pass
+
+    def close(self):
+        '''Writes out the queued messages and stops the background thread.'''
+        if self.thread is None:
+            return
+        self.messages.put(None)
+        self.thread.join()
+        self.thread = None
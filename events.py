@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+
+'''
+Zone state events.
+
+ZoneStateMachine turns the per-frame records of a ZoneTracker into a
+debounced zone state, clear, warning or danger, and reports its changes
+as events instead of leaving every consumer to poll the counts:
+
+enter    - clear to warning or danger
+escalate - warning to danger
+exit     - down a level, danger to warning or back to clear
+
+A level is raised when its count reaches the limit (the alarm limits of
+the tracker) on enter_frames frames in a row, and dropped only once the
+count stayed below release times the limit for exit_frames frames in a
+row, so a count wavering around a limit does not flap. An event is a
+JSON friendly dict with the record time and frame, the danger and
+warning counts, the centre of the zone points, the number of objects,
+the state before and, on leaving a state, how long it lasted.
+
+Events are delivered in batches, by a generator over records,
+
+    for batch in stream(records, machine):
+        ...
+
+or by a Dispatcher calling back at most every interval seconds of record
+time; events entering the danger state go out at once.
+
+Usage:
+  events.py [--interval <s>] [<records file>]
+
+prints the events of headless tracker records (default: stdin).
+'''
+
+# Python 2/3 compatibility
+from __future__ import print_function
+
+# built-in modules
+import sys
+import json
+
+
+STATES = ('clear', 'warning', 'danger')
+CLEAR, WARNING, DANGER = range(3)
+
+
+class ZoneStateMachine(object):
+    def __init__(self, danger_limit=300, warning_limit=175, release=0.7, enter_frames=3, exit_frames=15):
+        self.limits = (None, warning_limit, danger_limit)
+        self.release = release
+        self.enter_frames = enter_frames
+        self.exit_frames = exit_frames
+        self.level = CLEAR
+        self.since = None   # time of the last change
+        self.up = 0         # frames in a row above the state
+        self.down = 0       # frames in a row below the state
+
+    @property
+    def state(self):
+        return STATES[self.level]
+
+    def target(self, record):
+        '''Level the counts of record call for, holding the current one down to its release count.'''
+        for level, key in ((DANGER, 'danger'), (WARNING, 'warning')):
+            limit = self.limits[level]
+            if self.level >= level:
+                limit = self.release * limit
+            if record[key] >= limit:
+                return level
+        return CLEAR
+
+    def update(self, record):
+        '''Feeds the record of one frame; returns the events it caused, usually none.'''
+        target = self.target(record)
+        self.up = self.up + 1 if target > self.level else 0
+        self.down = self.down + 1 if target < self.level else 0
+        if self.up >= self.enter_frames:
+            kind = 'enter' if self.level == CLEAR else 'escalate'
+        elif self.down >= self.exit_frames:
+            kind = 'exit'
+        else:
+            return []
+        event = dict(type=kind, state=STATES[target], previous=self.state,
+                     time=record.get('time'), frame=record.get('frame'),
+                     danger=record['danger'], warning=record['warning'],
+                     center=record.get('center'), objects=len(record.get('objects') or ()))
+        if self.since is not None and record.get('time') is not None:
+            event['duration'] = record['time'] - self.since
+        if 'camera' in record:
+            event['camera'] = record['camera']
+        self.level = target
+        self.since = record.get('time')
+        self.up = self.down = 0
+        return [event]
+
+
+class Dispatcher(object):
+    '''Collects events and hands them to callback(batch) at most every interval seconds.
+
+    The clock is the record time, so offline runs batch like live ones.
+    Events whose new state is in urgent are delivered at once, together
+    with the ones waiting.
+    '''
+    def __init__(self, callback, interval=0.5, urgent=('danger',)):
+        self.callback = callback
+        self.interval = interval
+        self.urgent = urgent
+        self.pending = []
+        self.last = None    # time of the last delivery
+        self.batches = 0
+
+    def push(self, events, now):
+        '''Adds the events of the frame at time now and delivers the batch when due.'''
+        self.pending.extend(events)
+        if self.last is None:
+            self.last = now
+        if not self.pending:
+            return
+        if now - self.last >= self.interval or any(e['state'] in self.urgent for e in events):
+            self.flush(now)
+
+    def flush(self, now=None):
+        '''Delivers the waiting events, if any.'''
+        if now is not None:
+            self.last = now
+        if not self.pending:
+            return
+        batch, self.pending = self.pending, []
+        self.batches += 1
+        self.callback(batch)
+
+
+def stream(records, machine=None, interval=0.5, urgent=('danger',)):
+    '''Yields the events of an iterable of records in batches, see Dispatcher.'''
+    machine = machine or ZoneStateMachine()
+    batches = []
+    dispatcher = Dispatcher(batches.append, interval, urgent)
+    for record in records:
+        dispatcher.push(machine.update(record), record['time'])
+        while batches:
+            yield batches.pop(0)
+    dispatcher.flush()
+    while batches:
+        yield batches.pop(0)
+
+
+if __name__ == '__main__':
+    import getopt
+
+    args, sources = getopt.getopt(sys.argv[1:], '', ['interval='])
+    args = dict(args)
+    f = open(sources[0]) if sources else sys.stdin
+    records = (json.loads(line) for line in f if line.strip())
+    for batch in stream(records, interval=float(args.get('--interval', 0.5))):
+        for event in batch:
+            print(json.dumps(event))
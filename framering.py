@@ -0,0 +1,294 @@
+#!/usr/bin/env python
+
+'''
+Shared-memory frame ring between a capture process and tracker processes.
+
+FrameRing is a fixed ring of frame slots of one size (1280x720 BGR by
+default, or gray) in a multiprocessing.shared_memory block, every slot
+with the sequence number and the timestamp of the frame it holds. One
+process publishes the frames of a video.create_capture source into it,
+decoding straight into the slots; any number of tracker processes attach
+to the ring by name and read its frames as numpy views of the shared
+block, so no frame is pickled or copied on its way to the tracker.
+
+A slot is only rewritten when the writer has gone slots frames further,
+so a reader may use its view until then. RingCapture, the reading side,
+skips to the newest frame whenever it has fallen that far behind and
+counts the frames it dropped; lapped() tells whether the view of the
+last frame was overwritten while it was in use. tracker.App tracks the
+slot views in place and checks lapped() once the gray image is made,
+dropping the frame if the slot was rewritten meanwhile; only the frames
+it draws are copied out of the ring, for the overlay. A reader that
+sees no new frame for timeout seconds takes the writer for dead and
+ends, as if the ring were closed.
+
+Usage:
+  framering.py [--name <name>] [--slots <n>] [--size <w>x<h>] [--gray] [<video source>]
+
+publishes the source (default: camera 0) until it ends. Trackers read
+the ring as the video source ring:name=<name>, for example
+
+  framering.py --name front 0 &
+  trackerFront.py ring:name=front
+  trackerFront.py ring:name=front:timeout=30
+  multicam.py front=ring:name=front
+
+--name <name>    - name of the shared memory block (default: frames)
+--slots <n>      - frames in the ring (default: 8)
+--size <w>x<h>   - frame size, other frames are resized (default: 1280x720)
+--gray           - keep gray frames instead of BGR
+'''
+
+# Python 2/3 compatibility
+from __future__ import print_function
+
+import numpy as np
+import cv2 as cv
+
+# built-in modules
+import os
+import time
+from multiprocessing import shared_memory, resource_tracker
+
+
+HEADER = 8      # int64: head, slots, height, width, channels, closed
+ALIGN = 64
+
+
+def _tracked_name(shm):
+    '''Name the resource tracker knows a POSIX block by.'''
+    return '/' + shm.name
+
+
+def _attach(name):
+    '''Opens the block of an existing ring, which stays its creator's to unlink.'''
+    try:
+        return shared_memory.SharedMemory(name, track=False)  # Python 3.13
+    except TypeError:
+        pass
+    # Before 3.13 attaching registers the block with the resource tracker,
+    # which unlinks it when the process exits; take it off again. A reader
+    # sharing the tracker of the creator takes its entry off too, so the
+    # creator registers the block again before unlinking it, see close().
+    shm = shared_memory.SharedMemory(name)
+    if os.name == 'posix':
+        resource_tracker.unregister(_tracked_name(shm), 'shared_memory')
+    return shm
+
+
+class FrameRing(object):
+    def __init__(self, name=None, create=False, slots=8, size=(1280, 720), channels=3):
+        '''name: of the shared memory block, None for a new one with a generated name
+        create: make the block; otherwise attach to it and take slots, size and channels from it
+        '''
+        if create:
+            w, h = size
+            nbytes = self._layout(slots, h, w, channels)
+            self.shm = shared_memory.SharedMemory(name, create=True, size=nbytes)
+        else:
+            self.shm = _attach(name)
+            _, slots, h, w, channels, _ = np.ndarray(6, np.int64, self.shm.buf)
+            nbytes = self._layout(slots, h, w, channels)
+        self.name = self.shm.name
+        self.owner = create
+        buf = self.shm.buf
+        self.header = np.ndarray(HEADER, np.int64, buf)
+        self.seqs = np.ndarray(slots, np.int64, buf, self.seqs_offset)
+        self.stamps = np.ndarray(slots, np.float64, buf, self.stamps_offset)
+        self.frames = np.ndarray((slots, h, w, channels) if channels > 1 else (slots, h, w), np.uint8,
+                                 buf, self.frames_offset)
+        if create:
+            self.header[:6] = (-1, slots, h, w, channels, 0)
+            self.seqs[:] = -1
+        self.slots = int(slots)
+        self.size = (int(w), int(h))
+        self.channels = int(channels)
+
+    def _layout(self, slots, h, w, channels):
+        '''Sets the offsets of the arrays in the block; returns its size.'''
+        self.seqs_offset = HEADER * 8
+        self.stamps_offset = self.seqs_offset + slots * 8
+        self.frames_offset = (self.stamps_offset + slots * 8 + ALIGN - 1) // ALIGN * ALIGN
+        return int(self.frames_offset + slots * h * w * channels)
+
+    @property
+    def head(self):
+        '''Sequence number of the newest frame, -1 before the first.'''
+        return int(self.header[0])
+
+    @property
+    def closed(self):
+        '''The writer has published its last frame.'''
+        return bool(self.header[5])
+
+    # writer side
+
+    def claim(self):
+        '''The next sequence number and its slot to fill, e.g. by cap.read(slot).
+        Readers still holding the frame in that slot see it lapped from now on.
+        '''
+        seq = self.head + 1
+        slot = seq % self.slots
+        self.seqs[slot] = -1
+        return seq, self.frames[slot]
+
+    def commit(self, seq, timestamp=None):
+        '''Publishes the claimed frame seq.'''
+        slot = seq % self.slots
+        self.stamps[slot] = time.time() if timestamp is None else timestamp
+        self.seqs[slot] = seq
+        self.header[0] = seq
+
+    def fill(self, slot, frame):
+        '''Converts frame into slot, resized to the ring size and to BGR or gray as needed.'''
+        if frame.ndim == 3 and self.channels == 1:
+            frame = cv.cvtColor(frame, cv.COLOR_BGR2GRAY)
+        elif frame.ndim == 2 and self.channels == 3:
+            frame = cv.cvtColor(frame, cv.COLOR_GRAY2BGR)
+        if frame.shape[1::-1] != self.size:
+            cv.resize(frame, self.size, dst=slot, interpolation=cv.INTER_AREA)
+        else:
+            np.copyto(slot, frame)
+
+    def write(self, frame, timestamp=None):
+        '''Copies frame into the next slot and publishes it; returns its sequence number.'''
+        seq, slot = self.claim()
+        self.fill(slot, frame)
+        self.commit(seq, timestamp)
+        return seq
+
+    def publish(self, cap):
+        '''Writes the frames of cap until it ends, reading them straight into the slots when it can.
+        Returns the number of frames published.
+        '''
+        n = 0
+        direct = self.channels == 3
+        while True:
+            seq, slot = self.claim()
+            ret, frame = cap.read(slot if direct else None)
+            if not ret or frame is None:
+                break
+            if not np.may_share_memory(frame, slot):
+                self.fill(slot, frame)
+            self.commit(seq)
+            n += 1
+        self.header[5] = 1
+        return n
+
+    # reader side
+
+    def holds(self, seq):
+        '''The slot of seq still holds that frame.'''
+        return self.seqs[seq % self.slots] == seq
+
+    def frame(self, seq):
+        '''View of frame seq in the shared block, valid while holds(seq).'''
+        return self.frames[seq % self.slots]
+
+    def timestamp(self, seq):
+        return float(self.stamps[seq % self.slots])
+
+    def close(self):
+        '''Detaches from the block; the creator also frees it.'''
+        self.header = self.seqs = self.stamps = self.frames = None
+        self.shm.close()
+        if self.owner:
+            if os.name == 'posix':
+                resource_tracker.register(_tracked_name(self.shm), 'shared_memory')
+            self.shm.unlink()
+
+
+class RingCapture(object):
+    '''Reads the frames of a FrameRing like a VideoCapture.
+
+    read() waits for the next frame and returns a view of its slot. A
+    reader that falls more than the ring behind the writer jumps to the
+    newest frame; with latest=True it always does, as for live cameras.
+    grab() and retrieve() let a StrideCapture skip frames.
+    '''
+    shared = True   # frames are views of the ring, see lapped()
+
+    def __init__(self, name='frames', latest=False, poll=0.001, timeout=5.0):
+        self.ring = FrameRing(name)
+        self.latest = latest
+        self.poll = poll            # seconds between looks for a new frame
+        self.timeout = timeout      # seconds without a new frame before the writer counts as gone
+        self.timed_out = False
+        self.seq = self.ring.head   # a new reader starts at the next frame
+        self.timestamp = None
+        self.read_frames = 0
+        self.dropped = 0
+
+    def grab(self):
+        ring = self.ring
+        head = ring.head
+        waited = time.time()
+        while head <= self.seq:
+            if ring.closed:
+                return False
+            if time.time() - waited > self.timeout:
+                self.timed_out = True  # the writer died without closing the ring
+                return False
+            time.sleep(self.poll)
+            head = ring.head
+        seq = self.seq + 1
+        # the slot after head is the next one the writer rewrites
+        if self.latest or seq < head + 2 - ring.slots:
+            seq = head
+        self.dropped += seq - self.seq - 1
+        self.seq = seq
+        self.read_frames += 1
+        return True
+
+    def retrieve(self, dst=None):
+        self.timestamp = self.ring.timestamp(self.seq)
+        return True, self.ring.frame(self.seq)
+
+    def read(self, dst=None):
+        if not self.grab():
+            return False, None
+        return self.retrieve()
+
+    def lapped(self):
+        '''The writer has reused the slot of the last frame read.'''
+        return not self.ring.holds(self.seq)
+
+    def isOpened(self):
+        return self.ring is not None
+
+    def stats(self):
+        return dict(read=self.read_frames, dropped=self.dropped, behind=self.ring.head - self.seq)
+
+    def release(self):
+        if self.ring is not None:
+            self.ring.close()
+            self.ring = None
+
+
+if __name__ == '__main__':
+    import sys
+    import getopt
+
+    # local modules
+    import video
+
+    print(__doc__)
+
+    args, sources = getopt.getopt(sys.argv[1:], '', ['name=', 'slots=', 'size=', 'gray'])
+    args = dict(args)
+    source = sources[0] if sources else 0
+    size = tuple(map(int, args.get('--size', '1280x720').split('x')))
+    cap = video.create_capture(source, fallback=None)
+    if cap is None or not cap.isOpened():
+        sys.exit(1)
+    ring = FrameRing(args.get('--name', 'frames'), create=True, slots=int(args.get('--slots', 8)),
+                     size=size, channels=1 if '--gray' in args else 3)
+    print('publishing %s to ring %s' % (source, ring.name))
+    try:
+        print('%d frames' % ring.publish(cap))
+        # keep the block until the readers are through the last frames
+        sys.stdin.readline()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        ring.close()
@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+
+'''
+Latency budget of the tracking loop.
+
+LatencyController watches how long the tracker works per captured frame
+(tracking and drawing, spread over the frames that were skipped) and
+keeps it under a budget, e.g. the 33 ms between the frames of a 30 fps
+camera, by stepping along a ladder of cheaper settings:
+
+level  stride  corners  levels  scale  overlay
+  0      1      1.0       0      1.0    yes      as configured
+  1      2      1.0       0      1.0    yes      skip every other frame
+  2      2      0.5       0      1.0    yes      half of maxCorners
+  3      2      0.5       1      1.0    yes      one LK pyramid level less
+  4      2      0.5       1      0.5    yes      half the processing scale
+  5      2      0.5       1      0.5    no       frames shown without overlay
+  6      4      0.5       1      0.5    no       track every 4th frame
+
+stride multiplies the App stride, corners and scale multiply maxCorners
+and the processing scale, levels is taken off the LK maxLevel. A level
+is left down after the mean cost of window frames exceeds the budget,
+and up after patience frames whose cost, estimated for the level above,
+stays below headroom times the budget.
+
+The estimate scales the cost by the measured ratio between the two
+levels, taken on the first window after stepping down between them,
+or until then by relative_cost(), which counts the processed pixels and
+corners per captured frame. A level that was retried and went over the
+budget again waits twice as long, up to max_wait frames, before the next
+try; once it held for patience frames the wait is back to patience.
+'''
+
+# Python 2/3 compatibility
+from __future__ import print_function
+
+import numpy as np
+
+
+LADDER = [
+    dict(stride=1, corners=1.0, levels=0, scale=1.0, overlay=True),
+    dict(stride=2, corners=1.0, levels=0, scale=1.0, overlay=True),
+    dict(stride=2, corners=0.5, levels=0, scale=1.0, overlay=True),
+    dict(stride=2, corners=0.5, levels=1, scale=1.0, overlay=True),
+    dict(stride=2, corners=0.5, levels=1, scale=0.5, overlay=True),
+    dict(stride=2, corners=0.5, levels=1, scale=0.5, overlay=False),
+    dict(stride=4, corners=0.5, levels=1, scale=0.5, overlay=False),
+]
+
+
+def relative_cost(settings):
+    '''Rough work per captured frame of a ladder level, 1 for level 0.
+    Image work goes with the pixels, the flow with the corners; the
+    pyramid levels and the overlay are left out.
+    '''
+    return settings['scale'] ** 2 * (1 + settings['corners']) / 2.0 / settings['stride']
+
+
+class LatencyController(object):
+    def __init__(self, budget, ladder=LADDER, window=10, headroom=0.6, patience=60, max_wait=16):
+        '''budget: seconds of work allowed per captured frame
+        max_wait: longest wait before retrying a level, in patience periods
+        '''
+        self.budget = budget
+        self.ladder = ladder
+        self.headroom = headroom
+        self.patience = patience
+        self.max_wait = max_wait * patience
+        self.costs = np.zeros(window)   # seconds per captured frame of the last processed frames
+        self.filled = 0                 # frames processed at the current level
+        self.level = 0
+        self.changes = 0
+        self.ratios = {}                # level: measured cost over the cost of the level below
+        self.waits = [patience] * len(ladder)  # frames below a level before trying it
+        self.left = None                # (level, cost) just left for the level below
+        self.retried = False            # the current level was entered from below
+
+    @property
+    def settings(self):
+        return self.ladder[self.level]
+
+    def update(self, busy, frames=1):
+        '''busy: seconds spent on the last processed frame, which stood for frames captured ones.
+        Returns True when the level changed; the new one is in settings.
+        '''
+        window = len(self.costs)
+        self.costs[self.filled % window] = busy / frames
+        self.filled += 1
+        if self.filled < window:
+            return False
+        cost = self.costs.mean()
+        if self.left is not None and self.filled == window:
+            level, left_cost = self.left
+            self.ratios[level] = left_cost / max(cost, 1e-9)
+            self.left = None
+        if cost > self.budget and self.level < len(self.ladder) - 1:
+            if self.retried:
+                self.waits[self.level] = min(2 * self.waits[self.level], self.max_wait)
+            self.left = (self.level, cost)
+            return self._step(1)
+        if self.retried and self.filled >= self.patience:
+            self.waits[self.level] = self.patience
+            self.retried = False
+        if self.level > 0 and self.filled >= self.waits[self.level - 1]:
+            if self.estimate(self.level - 1, cost) < self.headroom * self.budget:
+                return self._step(-1)
+        return False
+
+    def estimate(self, level, cost):
+        '''Cost per captured frame expected at level, from cost at the level below it.'''
+        ratio = self.ratios.get(level)
+        if ratio is None:
+            ratio = relative_cost(self.ladder[level]) / relative_cost(self.ladder[level + 1])
+        return cost * ratio
+
+    def _step(self, step):
+        self.level += step
+        self.changes += 1
+        self.retried = step < 0
+        self.filled = 0  # judge the new level on its own frames
+        return True
@@ -0,0 +1,212 @@
+#!/usr/bin/env python
+
+'''
+Multi-camera zone tracker.
+
+Runs one headless ZoneTracker per camera in a single command, each on
+its own worker process (or thread), and reports frames per second per
+camera and for the whole truck.
+
+Usage
+-----
+multicam.py [--threads] [--records <file>] [--interval <s>] [--scale <f>] [--adaptive-detect]
+            [--detect-exclude <zones>] [--zone-detect] [--dedup] <script>=<video_source> ...
+
+<script>=<video_source>  - camera tracked like the tracker script of that name tracks it,
+                           with its zone profile, parameters and stride, e.g.
+                           trackerFront=0 front_lk=1 trackerSide=rear.avi; a zone
+                           profile name stands for its script in SCRIPTS,
+                           e.g. front=0 side=1
+--threads                - one thread per camera instead of one process
+--records <file>         - JSON record of every frame of every camera (default: none)
+--interval <s>           - seconds between fps reports (default: 1)
+--scale <f>              - track on the gray images resized by f, e.g. 0.5 (default: 1)
+--adaptive-detect        - re-detect features only when tracks or zone coverage are lost,
+                           or every 30 tracked frames
+--detect-exclude <zones> - never look for new corners in these zones, e.g. free,none
+                           (see tracker.py)
+--zone-detect            - look for new corners only in the danger and warning zones
+--dedup                  - drop converged tracks and new corners next to live tracks
+
+Workers split the CPU cores between them through cv.setNumThreads,
+so N cameras never start N full OpenCV thread pools.
+'''
+
+# Python 2/3 compatibility
+from __future__ import print_function
+
+import cv2 as cv
+
+# built-in modules
+import sys
+import time
+import threading
+import multiprocessing
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+import importlib
+
+# local modules
+import video
+import zones
+import tracker
+
+
+# script of the cameras given by zone profile
+SCRIPTS = dict(front='trackerFront', front_near='lk_track', side='trackerSide')
+
+
+def camera_worker(name, script, source, params, cv_threads, out, stop):
+    '''Tracks one camera with the App configuration of script until its source
+    ends or stop is set; params override the ZoneTracker ones; records go to out.
+    '''
+    if cv_threads is not None:
+        cv.setNumThreads(cv_threads)
+    error = None
+    try:
+        App = importlib.import_module(script).App
+        cam = video.create_capture(source, None, stride=App.stride)
+        if cam is None or not cam.isOpened():
+            error = 'unable to open video source: %s' % (source,)
+            return
+        shared = getattr(cam, 'shared', False)
+        zone_tracker = tracker.ZoneTracker(*zones.profile(App.profile), **dict(App.params, **params))
+        while not stop.is_set():
+            ret, frame = cam.read()
+            if frame is None:
+                break
+            frame_gray = zone_tracker.to_gray(frame)
+            if shared and cam.lapped():  # ring slot rewritten meanwhile, as in tracker.App
+                continue
+            record = zone_tracker.process(frame, frame_gray)
+            record['camera'] = name
+            out.put(record)
+    finally:
+        out.put(dict(camera=name, done=True, error=error))
+
+
+class MultiCamera(object):
+    def __init__(self, cameras, use_threads=False, params={}):
+        '''cameras: list of (name, script, video_source)'''
+        self.cameras = cameras
+        self.use_threads = use_threads
+        self.params = params
+        self.frames = dict((name, 0) for name, _script, _source in cameras)
+        self.fps = dict((name, 0.0) for name, _script, _source in cameras)
+        self.errors = {}  # camera name -> why its source did not open
+
+    def _start(self):
+        n = len(self.cameras)
+        cores = multiprocessing.cpu_count()
+        per_camera = max(1, cores // n)
+        if self.use_threads:
+            # cv.setNumThreads is process wide, one pool is shared by all cameras
+            cv.setNumThreads(max(1, cores))
+            self.out, self.stop = queue.Queue(), threading.Event()
+            Worker, cv_threads = threading.Thread, None
+        else:
+            self.out, self.stop = multiprocessing.Queue(), multiprocessing.Event()
+            Worker, cv_threads = multiprocessing.Process, per_camera
+        self.workers = []
+        for name, script, source in self.cameras:
+            w = Worker(target=camera_worker,
+                       args=(name, script, source, self.params, cv_threads, self.out, self.stop))
+            w.daemon = True
+            w.start()
+            self.workers.append(w)
+
+    def run(self, on_record=None, on_report=None, interval=1.0):
+        '''Runs every camera to the end of its source, calling on_record(record) for
+        each frame and on_report(fps, total_fps) every interval seconds.
+        '''
+        self._start()
+        running = len(self.workers)
+        counted = dict(self.frames)
+        last = time.time()
+        try:
+            while running > 0:
+                try:
+                    record = self.out.get(timeout=interval)
+                except queue.Empty:
+                    record = None
+                if record is not None:
+                    if record.get('done'):
+                        running -= 1
+                        if record['error'] is not None:
+                            self.errors[record['camera']] = record['error']
+                    else:
+                        self.frames[record['camera']] += 1
+                        if on_record is not None:
+                            on_record(record)
+                now = time.time()
+                if now - last >= interval:
+                    for name in self.frames:
+                        self.fps[name] = (self.frames[name] - counted[name]) / (now - last)
+                    counted = dict(self.frames)
+                    last = now
+                    if on_report is not None:
+                        on_report(self.fps, sum(self.fps.values()))
+        finally:
+            self.stop.set()
+            for w in self.workers:
+                w.join()
+
+
+def parse_cameras(specs):
+    '''[<script>=<video_source>, ...] -> [(name, script, video_source), ...]
+    Cameras sharing a script or profile are named <script>, <script>2, ...
+    '''
+    cameras, seen = [], {}
+    for spec in specs:
+        key, _, source = spec.partition('=')
+        script = SCRIPTS.get(key, key)
+        try:
+            getattr(importlib.import_module(script), 'App')
+        except (ImportError, AttributeError):
+            script = None
+        if script is None or not source:
+            raise ValueError('bad camera %r, expected <script>=<video_source> with a tracker script '
+                             'or one of %s' % (spec, ', '.join(sorted(SCRIPTS))))
+        seen[key] = seen.get(key, 0) + 1
+        name = key if seen[key] == 1 else '%s%d' % (key, seen[key])
+        cameras.append((name, script, source))
+    return cameras
+
+
+def print_report(fps, total):
+    print('fps %.1f | %s' % (total, '  '.join('%s %.1f' % (name, fps[name]) for name in sorted(fps))),
+          file=sys.stderr)
+
+
+def main():
+    import getopt
+    args, specs = getopt.getopt(sys.argv[1:], '', ['threads', 'records=', 'interval=', 'scale=',
+                                                   'adaptive-detect', 'detect-exclude=', 'zone-detect', 'dedup'])
+    args = dict(args)
+    if not specs:
+        print(__doc__)
+        sys.exit(1)
+    multi = MultiCamera(parse_cameras(specs), use_threads='--threads' in args,
+                        params=dict(scale=float(args.get('--scale', 1.0)),
+                                    adaptive_detect='--adaptive-detect' in args,
+                                    detect_exclude=zones.labels_of(args.get('--detect-exclude', '')),
+                                    zone_detect='--zone-detect' in args,
+                                    dedup='--dedup' in args))
+    interval = float(args.get('--interval', 1.0))
+
+    if '--records' in args:
+        with open(args['--records'], 'w') as f:
+            multi.run(lambda record: tracker.write_record(f, record), print_report, interval)
+    else:
+        multi.run(None, print_report, interval)
+    for name in sorted(multi.errors):
+        print('%s: %s' % (name, multi.errors[name]), file=sys.stderr)
+    if multi.errors:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
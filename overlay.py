@@ -0,0 +1,200 @@
+#!/usr/bin/env python
+
+'''
+Operator overlay of the zone trackers.
+
+View is a snapshot of one ZoneTracker frame in full resolution frame
+coordinates: the zone polygons and alarms, the classified points, their
+arrow end points and, on request, their whole paths. Taking it is a few
+vectorized numpy operations, after which the tracker can move on to the
+next frame while the view is drawn, here or on a Renderer thread.
+
+The draw_* functions render a View with one OpenCV call per zone and
+colour instead of one per point: all arrows of a zone in two
+cv.polylines calls over (n, k, 2) arrays, pixel for pixel what
+cv.arrowedLine draws, and the dots written straight into the image
+through the pixel offsets of a cv.circle disc.
+
+Renderer draws on a background thread, keeping only the newest frame
+when the display falls behind, so the overlay costs the tracking loop
+no more than taking the View.
+'''
+
+# Python 2/3 compatibility
+from __future__ import print_function
+
+import numpy as np
+import cv2 as cv
+
+# built-in modules
+import threading
+
+# local modules
+import zones
+from common import draw_str
+
+
+DANGER_COLOR = (0, 0, 255)
+WARNING_COLOR = (0, 200, 255)
+
+
+class View(object):
+    def __init__(self, tracker, paths=False):
+        '''paths: also keep the oldest first path of every classified track'''
+        self.danger, self.warning = tracker.danger, tracker.warning
+        self.danger_alarm, self.warning_alarm = tracker.danger_alarm, tracker.warning_alarm
+        self.tracks = len(tracker.tracks)
+        self.on_zones = tracker.on_zones
+        self.center = tracker.center
+        self.objects = tracker.objects
+        n = len(tracker.zone)
+        self.zone = tracker.zone.copy()
+        self.points = tracker.to_frame(np.column_stack([tracker.xs, tracker.ys]))
+        self.first = tracker.to_frame(tracker.tracks.nth(0)[:n])
+        self.second = tracker.to_frame(tracker.tracks.nth(1)[:n])
+        self.paths = self.path_start = None
+        if paths:
+            ordered, lengths = tracker.tracks.ordered()
+            ordered, lengths = ordered[:n], lengths[:n]
+            # pad the short tracks with their newest point, a zero length segment draws nothing new
+            L = ordered.shape[1]
+            index = np.minimum(np.arange(L), lengths[:, np.newaxis] - 1)
+            ordered = ordered[np.arange(n)[:, np.newaxis], index]
+            self.paths = tracker.to_frame(ordered)
+            self.path_start = ordered[:, :2] / tracker.scale  # unrounded two oldest points
+
+
+def arrow_heads(p, q):
+    '''End points of the two head strokes cv.arrowedLine(p, q, tipLength=1) draws at q.'''
+    p, q = np.float64(p), np.float64(q)
+    tip = np.hypot(p[:, 0] - q[:, 0], p[:, 1] - q[:, 1])
+    angle = np.arctan2(p[:, 1] - q[:, 1], p[:, 0] - q[:, 0])
+    heads = []
+    for a in (angle + np.pi / 4, angle - np.pi / 4):
+        heads.append(np.rint(np.column_stack([q[:, 0] + tip * np.cos(a), q[:, 1] + tip * np.sin(a)])))
+    return heads
+
+
+def draw_arrow_batch(vis, p, q, color, thickness=2):
+    '''cv.arrowedLine(vis, p[i], q[i], color, thickness, tipLength=1) for every i in two calls.'''
+    if len(p) == 0:
+        return
+    h1, h2 = arrow_heads(p, q)
+    cv.polylines(vis, np.int32(np.stack([p, q], 1)), False, color, thickness)
+    cv.polylines(vis, np.int32(np.stack([h1, q, h2], 1)), False, color, thickness)
+
+
+_discs = {}
+
+def disc_offsets(radius):
+    '''(dy, dx) of the pixels of a filled cv.circle of that radius.'''
+    if radius not in _discs:
+        size = 2 * radius + 1
+        canvas = np.zeros((size, size), np.uint8)
+        cv.circle(canvas, (radius, radius), radius, 1, -1)
+        dy, dx = np.nonzero(canvas)
+        _discs[radius] = (dy - radius, dx - radius)
+    return _discs[radius]
+
+
+def draw_disc_batch(vis, points, radius, color):
+    '''cv.circle(vis, points[i], radius, color, -1) for every i at once.'''
+    if len(points) == 0:
+        return
+    dy, dx = disc_offsets(radius)
+    xs = (np.asarray(points)[:, 0, np.newaxis] + dx).ravel()
+    ys = (np.asarray(points)[:, 1, np.newaxis] + dy).ravel()
+    h, w = vis.shape[:2]
+    inside = (xs >= 0) & (xs < w) & (ys >= 0) & (ys < h)
+    vis[ys[inside], xs[inside]] = color
+
+
+def draw_paths(vis, paths, color):
+    '''Open polylines through every (k, 2) row of paths in one call.'''
+    if len(paths) > 0:
+        cv.polylines(vis, paths, False, color)
+
+
+def draw_zones(vis, view):
+    '''Outlines the danger and warning zones, in red while their alarm is raised.'''
+    cv.polylines(vis, [view.warning], True, (0, 0, 255) if view.warning_alarm else 255, 3)
+    cv.polylines(vis, [view.danger], True, (0, 0, 255) if view.danger_alarm else 255, 3)
+
+
+def draw_arrows(vis, view, warning_dots=True):
+    '''Speed vector of every point in the danger and warning zones, from the two oldest points of its track.'''
+    danger = view.zone == zones.DANGER
+    draw_arrow_batch(vis, view.first[danger], view.second[danger], (100, 10, 255))
+    warning = view.zone == zones.WARNING
+    draw_arrow_batch(vis, view.first[warning], view.second[warning], (100, 200, 255))
+    if warning_dots:
+        draw_disc_batch(vis, view.points[warning], 2, WARNING_COLOR)
+
+
+def draw_dots(vis, view):
+    '''Newest point of every track, coloured by zone; free zone points are left out.'''
+    for label, color in ((zones.DANGER, DANGER_COLOR), (zones.WARNING, WARNING_COLOR), (zones.NONE, (0, 255, 0))):
+        draw_disc_batch(vis, view.points[view.zone == label], 2, color)
+
+
+def draw_objects(vis, view, min_points=22):
+    '''Circles every object in the detection zones of more than min_points points, red in the danger zone.'''
+    draw_str(vis, (200, 20), 'track count on zones: %d' % view.on_zones)
+    centers, boxes, counts, labels = view.objects
+    big = counts > min_points
+    draw_str(vis, (200, 35), 'OBJECTS AT OUR DETECTION ZONES: %d' % big.sum())
+    for (cx, cy), (x0, y0, x1, y1), label in zip(centers[big].tolist(), boxes[big].tolist(), labels[big].tolist()):
+        radius = max(50, int(np.hypot(x1 - x0, y1 - y0) / 2))
+        cv.circle(vis, (cx, cy), radius, DANGER_COLOR if label == zones.DANGER else (0, 165, 255), 5)
+
+
+class Renderer(object):
+    '''Runs draw(vis, view) on a background thread.
+
+    submit() hands over a frame and its View without waiting; when the
+    previous one is still being drawn it is replaced, so the display
+    shows the newest frame rather than falling behind. latest() returns
+    the image finished since its last call, or None.
+    '''
+    def __init__(self, draw):
+        self.draw = draw
+        self.pending = None
+        self.ready = None
+        self.skipped = 0
+        self.running = True
+        self.cond = threading.Condition()
+        self.thread = threading.Thread(target=self._worker)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def submit(self, frame, view):
+        with self.cond:
+            if self.pending is not None:
+                self.skipped += 1
+            self.pending = (frame, view)
+            self.cond.notify()
+
+    def latest(self):
+        with self.cond:
+            vis, self.ready = self.ready, None
+        return vis
+
+    def _worker(self):
+        while True:
+            with self.cond:
+                while self.pending is None and self.running:
+                    self.cond.wait()
+                if self.pending is None:
+                    return
+                frame, view = self.pending
+                self.pending = None
+            vis = frame.copy()
+            self.draw(vis, view)
+            with self.cond:
+                self.ready = vis
+
+    def close(self):
+        with self.cond:
+            self.running = False
+            self.cond.notify()
+        self.thread.join()
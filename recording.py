@@ -0,0 +1,234 @@
+#!/usr/bin/env python
+
+'''
+Track recordings: the optical flow results of a run, replayed without it.
+
+TrackRecorder, given to a ZoneTracker, stores per frame the end points
+of the tracks after the optical flow with their track ids and flags
+(VALID when the track passed the forward-backward check and survived,
+BORN for the corners detected on that frame) in a directory of
+columnar NumPy files:
+
+meta.json             - frame size, processing scale, track_len, profile,
+                        alarm limits and chunk_frames, written with the
+                        first frame and updated with the frame count on close
+frames.<chunk>.npy    - per frame: first row, rows of the optical flow,
+                        end row, detection reason, merged tracks and
+                        processing scale
+points.<chunk>.npy    - (rows, 2) float32 end points in processing coordinates
+ids.<chunk>.npy       - uint32 track ids
+flags.<chunk>.npy     - uint8 VALID | BORN
+
+A chunk holds chunk_frames frames and is written once it is full, its
+frame index last, so a recording of hours costs a bounded amount of
+memory and I/O per chunk, and one cut short by a crash still replays up
+to its last complete chunk. Every file loads with np.load(mmap_mode='r').
+
+ReplayTracker is a ZoneTracker fed from a TrackRecording instead of
+video: it rebuilds the tracks from the stored rows and runs the zone
+classification, objects and counts of every frame, with any polygons
+and alarm limits, at the speed of those numpy operations. With the
+polygons and limits of the recorded run the records are the ones of
+the run. replay() yields them, ready for events.stream().
+
+Usage
+-----
+recording.py [--profile <name>] [--danger-limit <n>] [--warning-limit <n>] [--records] <recording>
+
+prints the zone events of the recording, or with --records the records,
+for the zone polygons of the profile (default: the recorded one).
+'''
+
+# Python 2/3 compatibility
+from __future__ import print_function
+
+import numpy as np
+
+# built-in modules
+import os
+import json
+
+# local modules
+import zones
+import detection
+from tracker import ZoneTracker
+
+
+VALID = 1
+BORN = 2
+
+FRAME = np.dtype([('start', np.int64), ('advanced', np.int32), ('end', np.int64),
+                  ('detected', np.int8), ('merged', np.int32), ('scale', np.float32)])
+
+
+def column_path(path, name, chunk):
+    return os.path.join(path, '%s.%06d.npy' % (name, chunk))
+
+
+class TrackRecorder(object):
+    def __init__(self, path, profile=None, chunk_frames=256):
+        '''path: directory of the recording, created when missing'''
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        self.path = path
+        self.profile = profile
+        self.chunk_frames = chunk_frames
+        self.frames = []             # index entries of the current chunk
+        self.count = 0               # frames recorded
+        self.chunk = 0
+        self.columns = ([], [], [])  # points, ids and flags of the current chunk
+        self.rows = 0                # rows in the current chunk
+        self.start = 0               # first row of the current frame
+        self.advanced = 0            # optical flow rows of the current frame
+
+    def advance(self, points, ids, valid):
+        '''End points of the tracks ids after the optical flow; valid is False for the dropped ones.'''
+        self._append(points, ids, np.where(valid, VALID, 0))
+        self.advanced = len(ids)
+
+    def born(self, points, ids):
+        '''Corners detected on this frame, starting the tracks ids.'''
+        self._append(points, ids, np.full(len(ids), VALID | BORN))
+
+    def _append(self, points, ids, flags):
+        for column, values in zip(self.columns, (np.float32(points).reshape(-1, 2), np.uint32(ids), np.uint8(flags))):
+            column.append(values)
+        self.rows += len(ids)
+
+    def end_frame(self, tracker):
+        '''Closes the rows of the frame tracker has just processed.'''
+        if self.count == 0:
+            self.write_meta(tracker)
+        reason = -1 if tracker.detected is None else detection.REASONS.index(tracker.detected)
+        self.frames.append((self.start, self.advanced, self.rows, reason, tracker.merged, tracker.scale))
+        self.count += 1
+        self.start, self.advanced = self.rows, 0
+        if len(self.frames) == self.chunk_frames:
+            self.flush()
+
+    def flush(self):
+        '''Writes the current chunk, its frame index last.'''
+        if not self.frames:
+            return
+        for name, column in zip(('points', 'ids', 'flags'), self.columns):
+            np.save(column_path(self.path, name, self.chunk), np.concatenate(column))
+        np.save(column_path(self.path, 'frames', self.chunk), np.array(self.frames, FRAME))
+        self.chunk += 1
+        self.frames = []
+        self.columns = ([], [], [])
+        self.rows = self.start = 0
+
+    def write_meta(self, tracker):
+        '''Frame size, scale, track_len and alarm limits of the tracker, and the frames so far.'''
+        meta = dict(version=1, frames=self.count, chunk_frames=self.chunk_frames,
+                    size=list(tracker.size or (0, 0)), scale=tracker.base_scale,
+                    track_len=tracker.tracks.track_len, profile=self.profile,
+                    danger_limit=tracker.danger_limit, warning_limit=tracker.warning_limit)
+        path = os.path.join(self.path, 'meta.json')
+        with open(path + '.tmp', 'w') as f:
+            json.dump(meta, f, indent=2, sort_keys=True)
+        os.replace(path + '.tmp', path)
+
+    def close(self, tracker):
+        '''Writes the last chunk and the final meta.json.'''
+        self.flush()
+        self.write_meta(tracker)
+
+
+class TrackRecording(object):
+    '''A recording of a TrackRecorder, memory-mapped a chunk at a time.
+    Holds the frames of the complete chunks, all of them once the recorder closed.
+    '''
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, 'meta.json')) as f:
+            self.meta = json.load(f)
+        self.size = tuple(self.meta['size'])
+        self.scale = self.meta['scale']
+        self.track_len = self.meta['track_len']
+        self.chunk_frames = self.meta['chunk_frames']
+        self.index = []  # frame index of every chunk
+        while os.path.exists(column_path(path, 'frames', len(self.index))):
+            self.index.append(np.load(column_path(path, 'frames', len(self.index)), mmap_mode='r'))
+        self.length = sum(len(frames) for frames in self.index)
+        self.chunk = None
+        self.columns = None
+
+    def __len__(self):
+        return self.length
+
+    def frame(self, i):
+        '''Points, ids and flags of the rows of frame i, and its frame index entry.'''
+        chunk, row = divmod(i, self.chunk_frames)
+        entry = self.index[chunk][row]
+        if chunk != self.chunk:
+            self.chunk = chunk
+            self.columns = [np.load(column_path(self.path, name, self.chunk), mmap_mode='r')
+                            for name in ('points', 'ids', 'flags')]
+        points, ids, flags = [column[entry['start']:entry['end']] for column in self.columns]
+        return points, ids, flags, entry
+
+
+class ReplayTracker(ZoneTracker):
+    '''ZoneTracker replaying a TrackRecording; process() takes no frame.'''
+    def __init__(self, recording, danger, warning, free, **params):
+        params = dict(params, track_len=recording.track_len, scale=recording.scale)
+        super(ReplayTracker, self).__init__(danger, warning, free, **params)
+        self.recording = recording
+        self._resize(recording.size)
+
+    def process(self, frame=None, frame_gray=None):
+        '''Replays the next recorded frame and returns its record.'''
+        points, ids, flags, entry = self.recording.frame(self.frame_idx)
+        scale = float(entry['scale'])
+        if scale != self.scale:  # the latency ladder changed the scale of the run
+            self.set_quality(self.corners, 0, scale / self.base_scale)
+        k = int(entry['advanced'])
+        if k > 0:
+            if not np.array_equal(self.tracks.track_ids(), ids[:k]):
+                raise ValueError('recording %s is inconsistent at frame %d' % (self.recording.path, self.frame_idx))
+            self.tracks.advance(points[:k], (flags[:k] & VALID) > 0)
+            self.classify()
+        self.detected = None if entry['detected'] < 0 else detection.REASONS[entry['detected']]
+        self.merged = int(entry['merged'])
+        if len(ids) > k:
+            self.tracks.add(points[k:])
+        record = self.record()
+        self.frame_idx += 1
+        return record
+
+
+def replay(recording, danger, warning, free, **params):
+    '''Records of every frame of recording with these zone polygons and ZoneTracker params.'''
+    tracker = ReplayTracker(recording, danger, warning, free, **params)
+    for _ in range(len(recording)):
+        yield tracker.process()
+
+
+if __name__ == '__main__':
+    import sys
+    import getopt
+
+    # local modules
+    import events
+    from tracker import write_record
+
+    args, paths = getopt.getopt(sys.argv[1:], '', ['profile=', 'danger-limit=', 'warning-limit=', 'records'])
+    args = dict(args)
+    if not paths:
+        print(__doc__)
+        sys.exit(1)
+    recording = TrackRecording(paths[0])
+    meta = recording.meta
+    profile = args.get('--profile', meta['profile'])
+    limits = dict(danger_limit=int(args.get('--danger-limit', meta['danger_limit'])),
+                  warning_limit=int(args.get('--warning-limit', meta['warning_limit'])))
+    records = replay(recording, *zones.profile(profile), **limits)
+    if '--records' in args:
+        for record in records:
+            write_record(sys.stdout, record)
+    else:
+        machine = events.ZoneStateMachine(limits['danger_limit'], limits['warning_limit'])
+        for batch in events.stream(records, machine):
+            for event in batch:
+                write_record(sys.stdout, event)
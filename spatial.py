@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+
+'''
+Uniform grid index over the live track points.
+
+GridIndex sorts the points of a frame into cell x cell pixel squares,
+rebuilt every frame from the track arrays with one stable argsort and a
+bincount: the points of cell c are order[starts[c]:starts[c + 1]]. The
+queries are vectorized over all query points at once:
+
+in_cells   - the points in a list of cells
+pairs      - (query, point) pairs closer than a radius, looked up in the
+             cells around every query point only
+near       - the query points with an indexed point closer than a radius,
+             e.g. new corners within minDistance of a live track
+duplicates - the indexed points closer than a radius to an earlier one,
+             i.e. tracks that converged onto an older track
+
+Points outside the grid are kept in its border cells, so every point is
+found; distances always use the real coordinates.
+'''
+
+# Python 2/3 compatibility
+from __future__ import print_function
+
+import numpy as np
+
+
+class GridIndex(object):
+    def __init__(self, size, cell):
+        '''size: (w, h) of the frame, cell: side of the grid cells in pixels'''
+        w, h = size
+        self.cell = cell
+        self.grid = ((h + cell - 1) // cell, (w + cell - 1) // cell)  # rows, columns
+        self.starts = np.zeros(self.grid[0] * self.grid[1] + 1, np.intp)
+        self.order = np.zeros(0, np.intp)
+        self.points = np.zeros((0, 2), np.float32)
+
+    def cells(self, points):
+        '''Row and column of the cell of every (x, y) point.'''
+        p = np.asarray(points, np.float32).reshape(-1, 2)
+        rows, cols = self.grid
+        return (np.clip(p[:, 1] // self.cell, 0, rows - 1).astype(np.intp),
+                np.clip(p[:, 0] // self.cell, 0, cols - 1).astype(np.intp))
+
+    def build(self, points):
+        '''Indexes the (x, y) points, replacing the previous ones; returns self.'''
+        self.points = np.asarray(points, np.float32).reshape(-1, 2)
+        rows, cols = self.cells(self.points)
+        cells = rows * self.grid[1] + cols
+        self.order = np.argsort(cells, kind='stable')
+        np.cumsum(np.bincount(cells, minlength=len(self.starts) - 1), out=self.starts[1:])
+        return self
+
+    def in_cells(self, cells):
+        '''Indices of the points in the flat cells (row * columns + column), cell by cell,
+        and for every index the position in cells it was found for.
+        '''
+        cells = np.asarray(cells, np.intp)
+        begin = self.starts[cells]
+        counts = self.starts[cells + 1] - begin
+        full = np.nonzero(counts)[0]  # most cells are empty
+        begin, counts = begin[full], counts[full]
+        owner = np.repeat(full, counts)
+        first = np.cumsum(counts) - counts
+        slots = np.repeat(begin - first, counts) + np.arange(len(owner))
+        return self.order[slots], owner
+
+    def pairs(self, points, radius):
+        '''(i, j) pairs of query point i closer than radius to indexed point j.'''
+        p = np.asarray(points, np.float32).reshape(-1, 2)
+        rows, cols = self.cells(p)
+        reach = int(np.ceil(float(radius) / self.cell))
+        steps = np.arange(-reach, reach + 1)
+        dy, dx = [a.ravel() for a in np.meshgrid(steps, steps, indexing='ij')]
+        r = rows[:, np.newaxis] + dy
+        c = cols[:, np.newaxis] + dx
+        inside = (r >= 0) & (r < self.grid[0]) & (c >= 0) & (c < self.grid[1])
+        query = np.broadcast_to(np.arange(len(p))[:, np.newaxis], r.shape)[inside]
+        j, owner = self.in_cells((r * self.grid[1] + c)[inside])
+        i = query[owner]
+        d = p[i] - self.points[j]
+        close = (d * d).sum(1) < radius * radius
+        return i[close], j[close]
+
+    def near(self, points, radius):
+        '''True for every query point closer than radius to an indexed point.'''
+        i, _ = self.pairs(points, radius)
+        found = np.zeros(len(np.asarray(points).reshape(-1, 2)), bool)
+        found[i] = True
+        return found
+
+    def duplicates(self, radius, valid=None):
+        '''True for every indexed point closer than radius to one of lower index,
+        among the points selected by valid.
+        '''
+        i, j = self.pairs(self.points, radius)
+        earlier = j < i
+        if valid is not None:
+            valid = np.asarray(valid, bool).ravel()
+            earlier &= valid[i] & valid[j]
+        found = np.zeros(len(self.points), bool)
+        found[i[earlier]] = True
+        return found
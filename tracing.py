@@ -0,0 +1,175 @@
+#!/usr/bin/env python
+
+'''
+Per-stage timing of the tracking loop.
+
+Tracer times the stages of every frame (capture, gray, forward and
+backward LK, dropping converged tracks, advancing the track store, zone
+classification, feature re-detection and rendering) with monotonic
+nanosecond timestamps. Durations go into preallocated
+numpy buffers: a rolling window per stage for the p50/p95/p99 and a
+block of events that is written out whenever it fills, so the hot path
+never allocates or touches a file.
+
+The trace is either Chrome trace-event JSON (load it in chrome://tracing
+or https://ui.perfetto.dev, the percentiles show as counter tracks) or
+JSON lines, one event or summary per line.
+
+    tracer = Tracer(open('run.trace', 'w'))
+    t = tracer.now()
+    ...
+    t = tracer.mark(GRAY, t)    # gray took from t until now
+    tracer.next_frame()
+    tracer.close()
+'''
+
+# Python 2/3 compatibility
+from __future__ import print_function
+
+import numpy as np
+
+# built-in modules
+import os
+import sys
+import json
+import time
+
+# local modules
+from common import clock, StatValue
+
+try:
+    now_ns = time.monotonic_ns
+except AttributeError:  # Python 2
+    def now_ns():
+        return int(clock() * 1e9)
+
+
+CAPTURE, GRAY, FORWARD_LK, BACKWARD_LK, DEDUP, ADVANCE, ZONES, DETECT, RENDER = range(9)
+STAGES = ('capture', 'gray', 'forward_lk', 'backward_lk', 'dedup', 'advance', 'zones', 'detect', 'render')
+
+PERCENTILES = (50, 95, 99)
+
+
+class NoTracer(object):
+    '''Stands in for a Tracer when tracing is off.'''
+    def now(self):
+        return 0
+
+    def mark(self, stage, start):
+        return 0
+
+    def next_frame(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class Tracer(object):
+    def __init__(self, out=None, format='chrome', window=300, summary_interval=100, capacity=4096):
+        '''out: file for the trace, None keeps only the percentiles
+        format: 'chrome' or 'jsonl'
+        window: frames in the rolling percentiles
+        summary_interval: frames between percentile summaries in the trace, 0 for none
+        capacity: events buffered before they are written
+        '''
+        if format not in ('chrome', 'jsonl'):
+            raise ValueError('unknown trace format %r, expected chrome or jsonl' % format)
+        self.out = out
+        self.format = format
+        self.summary_interval = summary_interval
+        self.durations = np.zeros((len(STAGES), window), np.int64)  # ring of the last window durations
+        self.counts = np.zeros(len(STAGES), np.int64)
+        self.mean = [StatValue(0.9) for _ in STAGES]                # smoothed ns per stage
+        self.events = np.zeros((capacity, 4), np.int64)              # stage, frame, start, duration
+        self.pending = 0
+        self.frame = 0
+        self.origin = now_ns()
+        self.pid = os.getpid()
+        self.first = True
+        if out is not None and format == 'chrome':
+            out.write('[')
+
+    def now(self):
+        return now_ns()
+
+    def mark(self, stage, start):
+        '''Ends stage, begun at start (from now() or the previous mark); returns the end time.'''
+        end = now_ns()
+        duration = end - start
+        window = self.durations.shape[1]
+        self.durations[stage, self.counts[stage] % window] = duration
+        self.counts[stage] += 1
+        self.mean[stage].update(duration)
+        if self.out is not None:
+            self.events[self.pending] = (stage, self.frame, start - self.origin, duration)
+            self.pending += 1
+            if self.pending == len(self.events):
+                self.flush()
+        return end
+
+    def next_frame(self):
+        self.frame += 1
+        if self.summary_interval and self.frame % self.summary_interval == 0:
+            self.write_summary()
+
+    def percentiles(self):
+        '''{stage: (p50, p95, p99)} in ms over the rolling window, for the stages that ran.'''
+        window = self.durations.shape[1]
+        result = {}
+        for i, name in enumerate(STAGES):
+            n = min(self.counts[i], window)
+            if n > 0:
+                result[name] = tuple(np.percentile(self.durations[i, :n], PERCENTILES) / 1e6)
+        return result
+
+    def _write(self, item):
+        if self.format == 'chrome':
+            self.out.write(('\n' if self.first else ',\n') + json.dumps(item))
+            self.first = False
+        else:
+            self.out.write(json.dumps(item) + '\n')
+
+    def flush(self):
+        '''Writes the buffered events.'''
+        if self.out is None:
+            return
+        for stage, frame, start, duration in self.events[:self.pending].tolist():
+            if self.format == 'chrome':
+                self._write(dict(name=STAGES[stage], cat='tracker', ph='X', pid=self.pid, tid=0,
+                                 ts=start / 1000.0, dur=duration / 1000.0, args=dict(frame=frame)))
+            else:
+                self._write(dict(stage=STAGES[stage], frame=frame, start_ns=start, duration_ns=duration))
+        self.pending = 0
+
+    def write_summary(self):
+        if self.out is None:
+            return
+        self.flush()
+        stats = self.percentiles()
+        if self.format == 'chrome':
+            ts = (now_ns() - self.origin) / 1000.0
+            for k, p in enumerate(PERCENTILES):
+                self._write(dict(name='p%d ms' % p, ph='C', pid=self.pid, tid=0, ts=ts,
+                                 args=dict((name, v[k]) for name, v in stats.items())))
+        else:
+            self._write(dict(summary=dict((name, dict(zip(['p%d_ms' % p for p in PERCENTILES], v)))
+                                          for name, v in stats.items()),
+                             frame=self.frame))
+
+    def close(self):
+        if self.out is None:
+            return
+        self.write_summary()
+        if self.format == 'chrome':
+            self.out.write('\n]\n')
+        self.out.flush()
+
+
+def print_percentiles(tracer, f=sys.stderr):
+    '''Table of the rolling percentiles and the smoothed mean of every stage that ran.'''
+    stats = tracer.percentiles()
+    print('stage          p50 ms   p95 ms   p99 ms  mean ms', file=f)
+    for i, name in enumerate(STAGES):
+        if name in stats:
+            print('%-12s %8.2f %8.2f %8.2f %8.2f' % ((name,) + stats[name] + (tracer.mean[i].value / 1e6,)), file=f)
@@ -0,0 +1,555 @@
+#!/usr/bin/env python
+
+'''
+Zone tracker shared by the tracker scripts.
+
+ZoneTracker runs the Lucas-Kanade tracking and the zone classification
+of one camera and returns a plain dict record per frame. It never draws,
+so the same object serves the windowed scripts and the headless mode;
+overlay.View snapshots its state for drawing when wanted.
+
+The zone polygons are given in REFERENCE_SIZE (1280x720) coordinates and
+are scaled to the real frame size, read from the first frame. With a
+processing scale below 1 the optical flow and feature detection run on a
+resized gray image; the record and overlay.View map every point back
+to full resolution frame coordinates.
+
+The points in the danger and warning zones are grouped into objects,
+see clusters.py; the record lists every object with its centre, box,
+number of points and zone.
+
+set_quality() trades tracking quality for speed at run time; App uses it
+to hold a latency budget, see latency.py.
+
+App is the capture loop of the scripts and main() their command line.
+It runs the records through an events.ZoneStateMachine and hands the
+debounced zone events in batches to on_events(), which writes them to
+the --events file and the diagnostics.
+
+With --record-tracks the tracks of every frame are written to a
+recording.TrackRecorder, so the zone logic can be replayed from them
+with other polygons or limits without running the optical flow again.
+
+USAGE is the command line of every tracker script; main() prints it
+after the docstring of the script.
+'''
+
+# Python 2/3 compatibility
+from __future__ import print_function
+
+import numpy as np
+import cv2 as cv
+
+# built-in modules
+import os
+import sys
+import json
+import time
+
+# local modules
+import video
+import zones
+import tracing
+import diagnostics
+import detection
+import latency
+import overlay
+import clusters
+import spatial
+import events
+from tracks import TrackStore
+
+
+lk_params = dict(winSize=(15, 15),
+                 maxLevel=2,
+                 criteria=(cv.TERM_CRITERIA_EPS | cv.TERM_CRITERIA_COUNT, 10, 0.03))
+
+feature_params = dict(maxCorners=500,
+                      qualityLevel=0.3,
+                      minDistance=7,
+                      blockSize=7)
+
+# frame size the zone polygons are drawn for
+REFERENCE_SIZE = (1280, 720)
+
+
+class ZoneTracker(object):
+    def __init__(self, danger, warning, free, track_len=10, detect_interval=5,
+                 danger_limit=300, warning_limit=175, scale=1.0, tracer=None,
+                 adaptive_detect=False, detect_exclude=(), zone_detect=False, quotas=None,
+                 cluster_cell=32, cluster_min=3, dedup=False, dedup_radius=2.0, recorder=None):
+        self.polygons = [np.float64(danger), np.float64(warning), np.float64(free)]
+        self.scale = self.base_scale = scale
+        self.corners = 1.0    # share of maxCorners in use, see set_quality
+        self.detect_exclude = detect_exclude  # zone labels never searched for corners, e.g. (zones.FREE,)
+        self.zone_detect = zone_detect        # corners only in the danger and warning zones, see ZoneDetector
+        self.quotas = quotas
+        self.cluster_size = cluster_cell  # grid cell of the object clustering in frame pixels
+        self.cluster_min = cluster_min    # fewest points of an object
+        self.dedup = dedup                # drop converged tracks and corners next to live tracks
+        self.dedup_size = dedup_radius    # tracks closer than that in frame pixels have converged
+        self.merged = 0                   # converged tracks dropped on the last frame
+        self.recorder = recorder          # recording.TrackRecorder of the tracks of every frame
+        self.scheduler = detection.DetectionScheduler(detect_interval, adaptive=adaptive_detect)
+        self.size = None    # frame size, known after the first frame
+        self._resize(REFERENCE_SIZE)
+        self.tracks = TrackStore(track_len)
+        self.lk_params = dict(lk_params)
+        self.danger_limit = danger_limit    # points in the danger zone that raise the alarm
+        self.warning_limit = warning_limit  # points in the warning zone that raise the alarm
+        self.frame_idx = 0
+        self.prev_gray = None
+        self.tracer = tracer or tracing.NoTracer()
+
+        # state of the last frame, the first len(self.zone) tracks are the classified ones
+        self.counts = np.zeros(zones.WARNING + 1, np.intp)
+        self.zone = np.zeros(0, np.int8)
+        self.xs = self.ys = np.zeros(0, np.intp)
+        self.center = None
+        self.on_zones = 0
+        # centres, boxes (x0, y0, x1, y1) in frame coordinates, point counts and zones of the objects
+        self.objects = clusters.find_objects(self.xs, self.ys, self.zone, self.labels.shape)
+        self.detected = None  # reason of the detection on the last frame, see detection.REASONS
+
+    def _resize(self, size):
+        '''Fits the zones to frames of size (w, h).'''
+        w, h = size
+        self.size = size
+        self.work_size = (max(1, int(round(w * self.scale))), max(1, int(round(h * self.scale))))
+        fx, fy = float(w) / REFERENCE_SIZE[0], float(h) / REFERENCE_SIZE[1]
+        # polygons in frame coordinates for drawing and in processing coordinates for the raster
+        self.danger, self.warning, self.free = [np.int32(np.round(p * (fx, fy))) for p in self.polygons]
+        work = [np.int32(np.round(p * (fx, fy) * self.scale)) for p in self.polygons]
+        self.labels = zones.load_zone_raster(work[0], work[1], work[2], self.work_size)
+        self.feature_params = dict(feature_params,
+                                   maxCorners=max(1, int(round(feature_params['maxCorners'] * self.corners))),
+                                   minDistance=max(1, int(round(feature_params['minDistance'] * self.scale))))
+        self.mask_radius = max(1, int(round(5 * self.scale)))
+        self.mask_builder = detection.MaskBuilder(self.work_size, self.mask_radius, self.labels, self.detect_exclude)
+        self.zone_detector = None
+        if self.zone_detect:
+            self.zone_detector = detection.ZoneDetector(self.labels, self.feature_params, self.quotas)
+        self.scheduler.set_zones(self.labels, cell=max(4, int(round(32 * self.scale))))
+        self.cluster_cell = max(2, int(round(self.cluster_size * self.scale)))
+        self.dedup_radius = self.dedup_size * self.scale
+        self.index = spatial.GridIndex(self.work_size, self.feature_params['minDistance'])
+
+    def set_quality(self, corners=1.0, levels=0, scale=1.0):
+        '''Tracks with corners times maxCorners, levels LK pyramid levels less and
+        scale times the processing scale given to the constructor; the live tracks
+        carry over.
+        '''
+        self.lk_params['maxLevel'] = max(0, lk_params['maxLevel'] - levels)
+        new_scale = self.base_scale * scale
+        ratio = new_scale / self.scale
+        if ratio == 1:
+            # the zone state of the frame size stays, only the corner budget may change
+            if corners != self.corners:
+                self.corners = corners
+                self.feature_params['maxCorners'] = max(1, int(round(feature_params['maxCorners'] * corners)))
+                if self.zone_detector is not None:
+                    self.zone_detector = detection.ZoneDetector(self.labels, self.feature_params, self.quotas)
+            return
+        self.corners = corners
+        self.scale = new_scale
+        self._resize(self.size)
+        self.tracks.rescale(ratio)
+        if self.prev_gray is not None:
+            self.prev_gray = cv.resize(self.prev_gray, self.work_size, interpolation=cv.INTER_AREA)
+
+    def to_frame(self, points):
+        '''Processing coordinates to integer full resolution frame coordinates.'''
+        return np.int32(np.asarray(points, np.float32) / self.scale)
+
+    def to_gray(self, frame):
+        '''The gray processing image of a BGR frame, fitting the zones to its size first.
+        Tracking state is left alone, so the caller may still drop the frame.
+        '''
+        t = self.tracer.now()
+        h, w = frame.shape[:2]
+        if (w, h) != self.size:
+            self._resize((w, h))
+        frame_gray = cv.cvtColor(frame, cv.COLOR_BGR2GRAY)
+        if self.work_size != self.size:
+            frame_gray = cv.resize(frame_gray, self.work_size, interpolation=cv.INTER_AREA)
+        self.tracer.mark(tracing.GRAY, t)
+        return frame_gray
+
+    def process(self, frame, frame_gray=None):
+        '''Tracks one BGR frame and returns its record; frame_gray: its to_gray(), when made already.'''
+        tracer = self.tracer
+        if frame_gray is None:
+            frame_gray = self.to_gray(frame)
+        t = tracer.now()
+
+        if len(self.tracks) > 0:
+            img0, img1 = self.prev_gray, frame_gray
+            p0 = self.tracks.latest()
+            p1, _st, _err = cv.calcOpticalFlowPyrLK(img0, img1, p0, None, **self.lk_params)
+            t = tracer.mark(tracing.FORWARD_LK, t)
+            p0r, _st, _err = cv.calcOpticalFlowPyrLK(img1, img0, p1, None, **self.lk_params)
+            t = tracer.mark(tracing.BACKWARD_LK, t)
+            d = abs(p0 - p0r).reshape(-1, 2).max(-1)
+            good = d < 1
+            self.merged = 0
+            if self.dedup and self.detected is not None:
+                # tracks converge over many frames, so they are looked for once a detection,
+                # on the first frame the new tracks are followed, not on every frame;
+                # the older track of a converged pair has the longer history, keep that one
+                converged = self.index.build(p1).duplicates(self.dedup_radius, good)
+                self.merged = int(converged.sum())
+                good &= ~converged
+                t = tracer.mark(tracing.DEDUP, t)
+            if self.recorder is not None:
+                self.recorder.advance(p1, self.tracks.track_ids(), good)
+            self.tracks.advance(p1, good)
+            t = tracer.mark(tracing.ADVANCE, t)
+
+            self.classify()
+            t = tracer.mark(tracing.ZONES, t)
+
+        self.detected = self.scheduler.due(self.frame_idx, len(self.tracks), self.zone, self.xs, self.ys)
+        if self.detected is not None:
+            mask = self.mask_builder.build(self.tracks.latest())
+            if self.zone_detector is not None:
+                found = self.zone if len(self.tracks) > 0 else self.zone[:0]
+                tracked = np.bincount(found[found > 0], minlength=zones.WARNING + 1)
+                p = self.zone_detector.detect(frame_gray, mask, {zones.DANGER: tracked[zones.DANGER],
+                                                                 zones.WARNING: tracked[zones.WARNING]})
+            else:
+                p = cv.goodFeaturesToTrack(frame_gray, mask=mask, **self.feature_params)
+            if p is not None:
+                p = np.float32(p).reshape(-1, 2)
+                if self.dedup and len(self.tracks) > 0:
+                    p = p[~self.index.build(self.tracks.latest()).near(p, self.feature_params['minDistance'])]
+                self.tracks.add(p)
+                if self.recorder is not None:
+                    self.recorder.born(p, self.tracks.track_ids()[len(self.tracks) - len(p):])
+            tracer.mark(tracing.DETECT, t)
+
+        if self.recorder is not None:
+            self.recorder.end_frame(self)
+        record = self.record()
+        self.frame_idx += 1
+        self.prev_gray = frame_gray
+        return record
+
+    def classify(self):
+        '''Zones, objects and zone counts of the tracks as they are after the optical flow.'''
+        self.zone, self.xs, self.ys = zones.classify(self.labels, self.tracks.latest())
+        on_zones = (self.zone == zones.DANGER) | (self.zone == zones.WARNING)
+        self.on_zones = ctr = int(on_zones.sum())
+        if ctr > 0:
+            cx = float(self.xs[on_zones].sum()) / ctr
+            cy = float(self.ys[on_zones].sum()) / ctr
+            self.center = tuple(self.to_frame((cx, cy)).tolist())
+        else:
+            self.center = None
+        centers, boxes, counts, labels = clusters.find_objects(self.xs, self.ys, self.zone, self.labels.shape,
+                                                               self.cluster_cell, self.cluster_min)
+        self.objects = (self.to_frame(centers), self.to_frame(boxes.reshape(-1, 2)).reshape(-1, 4),
+                        counts, labels)
+        self.counts = zones.count_zones(self.labels, *self.tracks.history())
+
+    @property
+    def danger_alarm(self):
+        return self.counts[zones.DANGER] >= self.danger_limit
+
+    @property
+    def warning_alarm(self):
+        return self.counts[zones.WARNING] >= self.warning_limit
+
+    def record(self):
+        '''Zone state of the last processed frame as a JSON friendly dict.'''
+        if self.danger_alarm:
+            state = 'danger'
+        elif self.warning_alarm:
+            state = 'warning'
+        else:
+            state = 'clear'
+        return dict(frame=self.frame_idx,
+                    time=time.time(),
+                    tracks=len(self.tracks),
+                    danger=int(self.counts[zones.DANGER]),
+                    warning=int(self.counts[zones.WARNING]),
+                    on_zones=self.on_zones,
+                    center=self.center,
+                    objects=[dict(center=c, box=b, points=n, zone='danger' if z == zones.DANGER else 'warning')
+                             for c, b, n, z in zip(*[a.tolist() for a in self.objects])],
+                    detected=self.detected,
+                    merged=self.merged,
+                    state=state)
+
+
+USAGE = '''Usage
+-----
+%s [--headless] [--records <file>] [--prefetch <n>] [--latest] [--scale <f>]
+    [--trace <file>] [--trace-format <f>] [--diagnostics <l>]
+    [--render-every <n>] [--render-thread] [--adaptive-detect] [--detect-exclude <zones>] [--zone-detect]
+    [--dedup] [--budget <ms>] [--events <file>] [--record-tracks <dir>]
+    [<video_source>]
+
+--headless         - no window and no drawing, one JSON record per frame
+--records <file>   - where the headless records go (default: stdout)
+--prefetch <n>     - decode up to n frames ahead on a background thread
+--latest           - prefetch keeping only the newest frame (live cameras); with
+                     --prefetch, --latest or a ring:name=<name> source the records
+                     carry the frames decoded, dropped and queued by the capture,
+                     and new drops are reported in the diagnostics
+--scale <f>        - track on the gray image resized by f, e.g. 0.5 (default: 1)
+--trace <file>     - per-stage timing trace, p50/p95/p99 per stage on exit
+                     (see tracing.py)
+--trace-format <f> - chrome (trace-event JSON, default) or jsonl
+--diagnostics <l>  - off, info (default) or debug; diagnostics print at most
+                     once a second per kind from a background thread, to
+                     stdout, or stderr with --headless
+--render-every <n> - draw and show only every n-th tracked frame (default: 1)
+--render-thread    - draw the overlay on a background thread
+--adaptive-detect  - re-detect features when tracks or zone coverage are lost
+                     instead of on every detect_interval-th frame, and at
+                     least every max_interval (30) tracked frames, which is
+                     30 times the stride in captured frames (see detection.py)
+--detect-exclude <zones>
+                   - never look for new corners in these zones, a comma
+                     separated list of danger, warning, free and none (outside
+                     every polygon), e.g. free,none
+--zone-detect      - look for new corners only in the danger and warning zones,
+                     maxCorners split between them by area
+--dedup            - drop tracks that converged onto an older one, checked once
+                     a detection, and new corners closer than minDistance to a
+                     live track (see spatial.py)
+--budget <ms>      - keep the work per captured frame under ms by skipping frames
+                     and lowering quality step by step (see latency.py); the
+                     records carry the active level
+--events <file>    - zone enter, escalate and exit events as JSON lines
+--record-tracks <dir>
+                   - record the track points, ids and flags of every frame
+                     for recording.py to replay
+
+
+Keys
+----
+ESC - exit
+'''
+
+
+def write_record(f, record):
+    f.write(json.dumps(record) + '\n')
+
+
+class App(object):
+    '''Capture loop of the tracker scripts.
+    Subclasses give the zone profile, the ZoneTracker parameters and draw().
+    '''
+    profile = None              # name of the zone polygons in zones.PROFILES
+    params = {}
+    stride = 1                  # only every stride-th frame is tracked
+    pause_on_escape = True      # ESC waits for a key in the terminal instead of quitting
+    paths = False               # draw() needs the whole path of the tracks, see overlay.View
+
+    def __init__(self, video_src, headless=False, records=sys.stdout, prefetch=0, latest=False, scale=1.0,
+                 tracer=None, sink=None, render_every=1, render_thread=False, adaptive_detect=False,
+                 detect_exclude=(), zone_detect=False, dedup=False, budget=None, event_log=None,
+                 record_tracks=None):
+        # the capture skips the frames between strides without decoding them; headless
+        # records come from the source asked for or not at all, never from the chess scene
+        fallback = None if headless else video.presets['chess']
+        self.cam = video.create_capture(video_src, fallback, prefetch=prefetch, latest=latest, stride=self.stride)
+        if self.cam is None or not self.cam.isOpened():
+            raise IOError('unable to open video source: %s' % (video_src,))
+        self.headless = headless
+        self.records = records
+        self.tracer = tracer or tracing.NoTracer()
+        # headless records may be on stdout, keep the diagnostics off it
+        self.sink = sink or diagnostics.Sink(sys.stderr if headless else sys.stdout)
+        self.render_every = render_every
+        self.render_thread = render_thread
+        self.overlay = True
+        self.dropped = 0    # frames the capture dropped, as last reported
+        # frames of a ring are views of its slots, valid until the writer comes round again
+        self.shared = getattr(self.cam, 'shared', False)
+        self.lapped_frames = 0  # ring frames rewritten while in use, and skipped
+        self.base_stride = self.stride
+        # budget in ms of work per captured frame, held by degrading the quality
+        self.controller = latency.LatencyController(budget / 1000.0) if budget else None
+        self.recorder = None
+        if record_tracks is not None:
+            import recording  # imports this module
+            self.recorder = recording.TrackRecorder(record_tracks, profile=self.profile)
+        self.tracker = ZoneTracker(*zones.profile(self.profile), scale=scale, tracer=self.tracer,
+                                   adaptive_detect=adaptive_detect, detect_exclude=detect_exclude,
+                                   zone_detect=zone_detect, dedup=dedup,
+                                   recorder=self.recorder, **self.params)
+        self.event_log = event_log  # file for the zone events, one JSON line each
+        self.zone_state = events.ZoneStateMachine(self.tracker.danger_limit, self.tracker.warning_limit)
+        self.dispatcher = events.Dispatcher(self.on_events)
+
+    def draw(self, vis, view):
+        '''Draws the overlay of view, an overlay.View, onto vis; may run on the render thread.'''
+        overlay.draw_zones(vis, view)
+
+    def read(self):
+        return self.cam.read()
+
+    def lapped(self):
+        '''The last frame read was a ring slot the writer has rewritten since; counts and reports it.'''
+        if not (self.shared and self.cam.lapped()):
+            return False
+        self.lapped_frames += 1
+        self.sink.log('lapped', 'ring slot rewritten while in use, %d frames skipped', self.lapped_frames)
+        return True
+
+    def on_events(self, batch):
+        '''Receives the zone events, a few batches a second at most; override to raise alerts.'''
+        if self.event_log is not None:
+            for event in batch:
+                write_record(self.event_log, event)
+        last = batch[-1]
+        self.sink.log('events', 'zone %s: %s (%d events)', last['type'], last['state'], len(batch))
+
+    def run(self):
+        self.renderer = None
+        if self.render_thread and not self.headless:
+            self.renderer = overlay.Renderer(self.draw)
+        try:
+            self._run()
+            self.dispatcher.flush()
+        finally:
+            if self.renderer is not None:
+                self.renderer.close()
+            if self.recorder is not None:
+                self.recorder.close(self.tracker)
+            self.sink.close()
+
+    def _run(self):
+        tracer = self.tracer
+        tracked = 0
+        while True:
+            t = tracer.now()
+            ret, frame = self.read()  # capture a frame
+            tracer.mark(tracing.CAPTURE, t)
+            if frame is None:
+                break
+            frames = self.cam.stride  # captured frames this one stands for
+            start = time.time()
+            frame_gray = self.tracker.to_gray(frame)
+            if self.lapped():  # the gray image may mix two frames, track the next one
+                tracer.next_frame()
+                continue
+            record = self.tracker.process(frame, frame_gray)
+            if self.controller is not None:
+                record['level'] = self.controller.level
+            self.capture_stats(record)
+            self.dispatcher.push(self.zone_state.update(record), record['time'])
+
+            if self.headless:
+                write_record(self.records, record)
+                tracer.next_frame()
+                self.control(time.time() - start, frames)
+                continue
+
+            tracked += 1
+            if tracked % self.render_every != 0:
+                tracer.next_frame()
+                self.control(time.time() - start, frames)
+                continue
+            t = tracer.now()
+            if self.shared:
+                # drawn and shown frames leave the ring slot, the tracked ones never do
+                frame = frame.copy()
+                if self.lapped():
+                    frame = None
+            if frame is None:
+                vis = None
+            elif not self.overlay:
+                vis = frame
+            elif self.renderer is not None:
+                self.renderer.submit(frame, overlay.View(self.tracker, self.paths))
+                vis = self.renderer.latest()
+            else:
+                vis = frame if self.shared else frame.copy()
+                self.draw(vis, overlay.View(self.tracker, self.paths))
+            if vis is not None:
+                cv.imshow('lk_track', vis)  # prints the frame
+            tracer.mark(tracing.RENDER, t)
+            tracer.next_frame()
+            self.control(time.time() - start, frames)
+            ch = 0xFF & cv.waitKey(1)  # if esc key is stroked, stop the video
+            if ch == 27:
+                if not self.pause_on_escape:
+                    break
+                sys.stdin.readline()  # waits for a key in terminal
+
+
+    def capture_stats(self, record):
+        '''Adds the counters of a prefetching or ring capture to record and reports its drops.'''
+        stats = self.cam.stats() if hasattr(self.cam, 'stats') else None
+        if stats is None:
+            return
+        record['capture'] = stats
+        if stats['dropped'] > self.dropped:
+            self.dropped = stats['dropped']
+            self.sink.log('capture', 'capture dropped %d frames so far: %s', stats['dropped'], stats)
+        else:
+            self.sink.debug('capture', 'capture %s', stats)
+
+    def control(self, busy, frames):
+        '''Feeds the latency controller and applies the level it picks.'''
+        if self.controller is None or not self.controller.update(busy, frames):
+            return
+        settings = self.controller.settings
+        self.stride = self.cam.stride = self.base_stride * settings['stride']
+        self.overlay = settings['overlay']
+        self.tracker.set_quality(settings['corners'], settings['levels'], settings['scale'])
+        self.sink.log('level', 'latency level %d: %s', self.controller.level, settings)
+
+
+def main(App):
+    import getopt
+    args, sources = getopt.getopt(sys.argv[1:], '', ['headless', 'records=', 'prefetch=', 'latest', 'scale=',
+                                                     'trace=', 'trace-format=', 'diagnostics=',
+                                                     'render-every=', 'render-thread', 'adaptive-detect',
+                                                     'detect-exclude=', 'zone-detect', 'dedup', 'budget=', 'events=',
+                                                     'record-tracks='])
+    args = dict(args)
+    video_src = sources[0] if sources else 0  # first argument is video source
+    options = dict(prefetch=int(args.get('--prefetch', 0)), latest='--latest' in args,
+                   scale=float(args.get('--scale', 1.0)),
+                   render_every=int(args.get('--render-every', 1)), render_thread='--render-thread' in args,
+                   adaptive_detect='--adaptive-detect' in args,
+                   detect_exclude=zones.labels_of(args.get('--detect-exclude', '')),
+                   zone_detect='--zone-detect' in args, dedup='--dedup' in args,
+                   budget=float(args['--budget']) if '--budget' in args else None,
+                   record_tracks=args.get('--record-tracks'))
+    level = diagnostics.LEVELS[args.get('--diagnostics', 'info')]
+    options['sink'] = diagnostics.Sink(sys.stderr if '--headless' in args else sys.stdout, level)
+    trace = open(args['--trace'], 'w') if '--trace' in args else None
+    if '--events' in args:
+        options['event_log'] = open(args['--events'], 'w')
+    if trace is not None:
+        options['tracer'] = tracing.Tracer(trace, args.get('--trace-format', 'chrome'))
+
+    def start(**kwargs):
+        try:
+            return App(video_src, **dict(options, **kwargs))
+        except IOError as e:
+            sys.exit('%s: %s' % (os.path.basename(sys.argv[0]), e))
+
+    try:
+        if '--headless' not in args:
+            print(sys.modules[App.__module__].__doc__)
+            print(USAGE % os.path.basename(sys.argv[0]))
+            start().run()  # runs the actual algorithm
+            cv.destroyAllWindows()  # closes the window
+        elif '--records' in args:
+            with open(args['--records'], 'w') as f:
+                start(headless=True, records=f).run()
+        else:
+            start(headless=True).run()
+    finally:
+        if trace is not None:
+            options['tracer'].close()
+            trace.close()
+            tracing.print_percentiles(options['tracer'])
+        if '--events' in args:
+            options['event_log'].close()
@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+
+'''
+Array backed store for the optical flow tracks.
+
+Every track keeps its last track_len points in a ring buffer inside one
+preallocated (capacity, track_len, 2) float32 array, so appending a point
+to every track, dropping the tracks that failed the forward-backward
+check and fetching the newest points for calcOpticalFlowPyrLK are all
+vectorized numpy operations instead of per-track Python lists. Every
+track gets an id, counting up from 0 in the order the tracks started.
+'''
+
+# Python 2/3 compatibility
+from __future__ import print_function
+
+import numpy as np
+
+
+class TrackStore(object):
+    def __init__(self, track_len=10, capacity=512):
+        self.track_len = track_len
+        self.count = 0
+        self.next_id = 0
+        self._allocate(capacity)
+
+    def _allocate(self, capacity):
+        L = self.track_len
+        self.points = np.zeros((capacity, L, 2), np.float32)  # ring buffer of every track
+        self.head = np.zeros(capacity, np.intp)               # slot holding the newest point
+        self.length = np.zeros(capacity, np.intp)             # number of valid slots
+        self.alive = np.zeros(capacity, bool)
+        self.last = np.zeros((capacity, 2), np.float32)       # newest point, kept contiguous for LK
+        self.ids = np.zeros(capacity, np.int64)
+
+    def _grow(self, needed):
+        capacity = len(self.points)
+        if needed <= capacity:
+            return
+        while capacity < needed:
+            capacity *= 2
+        n = self.count
+        old = self.points, self.head, self.length, self.alive, self.last, self.ids
+        self._allocate(capacity)
+        for dst, src in zip((self.points, self.head, self.length, self.alive, self.last, self.ids), old):
+            dst[:n] = src[:n]
+
+    def __len__(self):
+        return self.count
+
+    def clear(self):
+        self.count = 0
+
+    def add(self, points):
+        '''Starts one new track per (x, y) point.'''
+        points = np.asarray(points, np.float32).reshape(-1, 2)
+        n, k = self.count, len(points)
+        self._grow(n + k)
+        self.points[n:n+k, 0] = points
+        self.head[n:n+k] = 0
+        self.length[n:n+k] = 1
+        self.alive[n:n+k] = True
+        self.last[n:n+k] = points
+        self.ids[n:n+k] = np.arange(self.next_id, self.next_id + k)
+        self.next_id += k
+        self.count = n + k
+
+    def rescale(self, ratio):
+        '''Multiplies every point by ratio, for a new processing scale.'''
+        n = self.count
+        self.points[:n] *= ratio
+        self.last[:n] *= ratio
+
+    def track_ids(self):
+        '''Id of every track.'''
+        return self.ids[:self.count]
+
+    def latest(self):
+        '''Newest point of every track as a (n, 1, 2) view, ready for calcOpticalFlowPyrLK.'''
+        return self.last[:self.count].reshape(-1, 1, 2)
+
+    def advance(self, points, good=None):
+        '''Appends points[i] to track i, then drops the tracks where good is False.'''
+        n, L = self.count, self.track_len
+        points = np.asarray(points, np.float32).reshape(-1, 2)
+        head = (self.head[:n] + 1) % L
+        self.head[:n] = head
+        self.points[np.arange(n), head] = points
+        np.minimum(self.length[:n] + 1, L, out=self.length[:n])
+        self.last[:n] = points
+        if good is not None:
+            self.alive[:n] &= np.asarray(good, bool).ravel()
+        self.compact()
+
+    def compact(self):
+        '''Moves the alive tracks to the front, keeping their order.'''
+        n = self.count
+        keep = self.alive[:n]
+        if keep.all():
+            return
+        k = int(keep.sum())
+        for arr in (self.points, self.head, self.length, self.last, self.ids):
+            arr[:k] = arr[:n][keep]
+        self.alive[:k] = True
+        self.count = k
+
+    def nth(self, i):
+        '''i-th oldest point of every track (negative i counts from the newest).
+        Tracks shorter than that return their oldest or newest point.
+        '''
+        n, L = self.count, self.track_len
+        length = self.length[:n]
+        if i >= 0:
+            offset = length - 1 - np.minimum(i, length - 1)
+        else:
+            offset = np.minimum(-1 - i, length - 1)
+        slots = (self.head[:n] - offset) % L
+        return self.points[np.arange(n), slots]
+
+    def history(self):
+        '''(n, track_len, 2) points of every track in ring order and the mask of valid slots.'''
+        n, L = self.count, self.track_len
+        age = (self.head[:n, np.newaxis] - np.arange(L)) % L
+        return self.points[:n], age < self.length[:n, np.newaxis]
+
+    def ordered(self):
+        '''(n, track_len, 2) points of every track oldest first, and the track lengths.
+        Row i is valid up to length[i].
+        '''
+        n, L = self.count, self.track_len
+        length = self.length[:n]
+        slots = (self.head[:n, np.newaxis] - length[:, np.newaxis] + 1 + np.arange(L)) % L
+        return self.points[np.arange(n)[:, np.newaxis], slots], length
@@ -13,11 +13,20 @@ Usage:
     video.py [--shotdir <shot path>] [source0] [source1] ...'
     sourceN is an
      - integer number for camera capture
-     - name of video file
+     - name of video file, :start=<n> to begin at frame n
      - synth:<params> for procedural video
+     - ring:name=<name> for the frames another process publishes
+       in shared memory (see framering.py); the stream ends when the
+       writer closes the ring or sends nothing for timeout=<s> seconds
+       (default: 5)
 Synth examples:
     synth:bg=lena.jpg:noise=0.1
     synth:class=chess:bg=lena.jpg:noise=0.1:size=640x480
+    synth:class=scene:noise=0.05:size=1280x720:seed=1
+The seed parameter fixes the noise (and the textures of the scene class),
+so a synth source gives the same frames on every run.
+A stride (create_capture(..., stride=n)) returns every n-th frame; the
+skipped ones are only grabbed, never decoded to BGR nor rendered.
 Keys:
     ESC    - exit
     SPACE  - save current frame to <shot path> directory
@@ -34,14 +43,22 @@ from numpy import pi, sin, cos
 import cv2 as cv
 
 # built-in modules
-from time import clock
+import sys
+import threading
+try:
+    import queue
+except ImportError:
+    import Queue as queue
 
 # local modules
 from tst_scene_render import TestSceneRender
 import common
 
 class VideoSynthBase(object):
-    def __init__(self, size=None, noise=0.0, bg = None, **params):
+    def __init__(self, size=None, noise=0.0, bg = None, seed = None, **params):
+        self.seed = None if seed is None else int(seed)
+        self.noise_count = 0
+        self.grabbed = 0
         self.bg = None
         self.frame_size = (640, 480)
         if bg is not None:
@@ -52,13 +69,39 @@ class VideoSynthBase(object):
         if size is not None:
             w, h = map(int, size.split('x'))
             self.frame_size = (w, h)
-            self.bg = cv.resize(self.bg, self.frame_size)
+            if self.bg is not None:
+                self.bg = cv.resize(self.bg, self.frame_size)
 
         self.noise = float(noise)
 
+    def make_noise(self, shape):
+        noise = np.zeros(shape, np.int8)
+        if self.seed is not None:
+            # reseed per frame, the noise stays the same whatever else draws from the RNG
+            cv.setRNGSeed(self.seed + self.noise_count)
+            self.noise_count += 1
+        cv.randn(noise, np.zeros(3), np.ones(3)*255*self.noise)
+        return noise
+
     def render(self, dst):
         pass
 
+    def skip(self):
+        '''Moves on by one frame without rendering it.'''
+        if self.noise > 0.0:
+            self.noise_count += 1
+
+    def grab(self):
+        self.grabbed += 1
+        return True
+
+    def retrieve(self, dst=None):
+        '''Renders the last grabbed frame; the ones grabbed before it are skipped.'''
+        for _ in range(self.grabbed - 1):
+            self.skip()
+        self.grabbed = 0
+        return self.read(dst)
+
     def read(self, dst=None):
         w, h = self.frame_size
 
@@ -70,37 +113,52 @@ class VideoSynthBase(object):
         self.render(buf)
 
         if self.noise > 0.0:
-            noise = np.zeros((h, w, 3), np.int8)
-            cv.randn(noise, np.zeros(3), np.ones(3)*255*self.noise)
-            buf = cv.add(buf, noise, dtype=cv.CV_8UC3)
+            noise = self.make_noise((h, w, 3))
+            buf = cv.add(buf, noise, dst=dst, dtype=cv.CV_8UC3)
         return True, buf
 
     def isOpened(self):
         return True
 
-class Book(VideoSynthBase):
+class SceneSynth(VideoSynthBase):
+    '''Frames of the TestSceneRender in self.render, plus noise.'''
+    def skip(self):
+        self.noise_count += 1
+        self.render.time += self.render.timeStep
+
+    def read(self, dst=None):
+        noise = self.make_noise(self.render.sceneBg.shape)
+
+        return True, cv.add(self.render.getNextFrame(), noise, dst=dst, dtype=cv.CV_8UC3)
+
+class Book(SceneSynth):
     def __init__(self, **kw):
         super(Book, self).__init__(**kw)
         backGr = cv.imread(cv.samples.findFile('graf1.png'))
         fgr = cv.imread(cv.samples.findFile('box.png'))
         self.render = TestSceneRender(backGr, fgr, speed = 1)
 
-    def read(self, dst=None):
-        noise = np.zeros(self.render.sceneBg.shape, np.int8)
-        cv.randn(noise, np.zeros(3), np.ones(3)*255*self.noise)
-
-        return True, cv.add(self.render.getNextFrame(), noise, dtype=cv.CV_8UC3)
-
-class Cube(VideoSynthBase):
+class Cube(SceneSynth):
     def __init__(self, **kw):
         super(Cube, self).__init__(**kw)
         self.render = TestSceneRender(cv.imread(cv.samples.findFile('pca_test1.jpg')), deformation = True,  speed = 1)
 
-    def read(self, dst=None):
-        noise = np.zeros(self.render.sceneBg.shape, np.int8)
-        cv.randn(noise, np.zeros(3), np.ones(3)*255*self.noise)
+def texture(rng, w, h):
+    '''Blurred random BGR texture, corners for goodFeaturesToTrack everywhere.'''
+    return cv.GaussianBlur(np.uint8(rng.rand(h, w, 3) * 255), (7, 7), 0)
 
-        return True, cv.add(self.render.getNextFrame(), noise, dtype=cv.CV_8UC3)
+class Scene(SceneSynth):
+    '''TestSceneRender of a patch sliding over a background.
+    Without bg both are random textures drawn from seed, so no sample
+    images are needed.
+    '''
+    def __init__(self, seed=0, **kw):
+        super(Scene, self).__init__(seed=seed, **kw)
+        w, h = self.frame_size
+        rng = np.random.RandomState(int(seed))
+        backGr = self.bg if self.bg is not None else texture(rng, w, h)
+        fgr = texture(rng, w // 4, h // 4)
+        self.render = TestSceneRender(backGr, fgr, speed = 1)
 
 class Chess(VideoSynthBase):
     def __init__(self, **kw):
@@ -131,6 +189,10 @@ class Chess(VideoSynthBase):
         for q in img_quads:
             cv.fillConvexPoly(img, np.int32(q*4), color, cv.LINE_AA, shift=2)
 
+    def skip(self):
+        super(Chess, self).skip()
+        self.t += 1.0/30.0
+
     def render(self, dst):
         t = self.t
         self.t += 1.0/30.0
@@ -150,7 +212,148 @@ class Chess(VideoSynthBase):
         self.draw_quads(dst, self.black_quads, (10, 10, 10))
 
 
-classes = dict(chess=Chess, book=Book, cube=Cube)
+class StrideCapture(object):
+    '''Returns every stride-th frame of cap.
+
+    The frames in between are only grab()bed, so a video file or camera
+    never converts them to BGR and a synth source never renders them.
+    stride may be changed between reads.
+    '''
+    def __init__(self, cap, stride=1):
+        self.cap = cap
+        self.stride = stride
+
+    def read(self, dst=None):
+        for _ in range(self.stride - 1):
+            if not self.cap.grab():
+                return False, None
+        if not self.cap.grab():
+            return False, None
+        return self.cap.retrieve(dst)
+
+    def isOpened(self):
+        return self.cap.isOpened()
+
+    @property
+    def shared(self):
+        '''The frames are views of a buffer the source rewrites, see lapped().'''
+        return getattr(self.cap, 'shared', False)
+
+    def lapped(self):
+        return self.cap.lapped() if self.shared else False
+
+    def stats(self):
+        '''Counters of the wrapped capture, None when it keeps none.'''
+        return self.cap.stats() if hasattr(self.cap, 'stats') else None
+
+    def release(self):
+        if hasattr(self.cap, 'release'):
+            self.cap.release()
+
+
+class PrefetchCapture(object):
+    '''Decodes frames from cap on a background thread.
+
+    Frames wait in a bounded queue of queue_size entries; when it is full
+    the reader thread blocks, so no frame of a file is lost. With
+    latest=True only the newest frame is kept and older ones are dropped,
+    which suits live cameras: a slow consumer never falls behind.
+    read() and isOpened() behave like the wrapped capture; an exception
+    raised by its read() on the reader thread is raised again by read()
+    after the frames decoded before it.
+    '''
+    _end = (False, None)
+
+    def __init__(self, cap, queue_size=4, latest=False):
+        if not isinstance(cap, StrideCapture):
+            cap = StrideCapture(cap)  # so the stride can be changed while reading ahead
+        self.cap = cap
+        self.latest = latest
+        self.frames = queue.Queue(maxsize=1 if latest else max(1, queue_size))
+        self.decoded = 0
+        self.dropped = 0
+        self.running = True
+        self.finished = False
+        self.error = None  # what ended the reader thread, if not the end of the source
+        self.thread = threading.Thread(target=self._reader)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _put(self, item, keep_all=False):
+        if self.latest and not keep_all:
+            try:
+                self.frames.put_nowait(item)
+            except queue.Full:
+                try:
+                    self.frames.get_nowait()
+                    self.dropped += 1
+                except queue.Empty:
+                    pass
+                self.frames.put_nowait(item)
+            return True
+        while self.running:
+            try:
+                self.frames.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _reader(self):
+        try:
+            while self.running:
+                ret, frame = self.cap.read()
+                if not ret or frame is None:
+                    break
+                self.decoded += 1
+                if not self._put((ret, frame)):
+                    return
+        except Exception as e:  # ends the stream, read() raises it in the consumer
+            self.error = e
+        self._put(self._end, keep_all=True)  # never drop the last frame for the end marker
+
+    def read(self, dst=None):
+        if self.finished:
+            return self._end
+        ret, frame = self.frames.get()
+        if frame is None:
+            self.finished = True
+            if self.error is not None:
+                raise self.error
+        return ret, frame
+
+    def isOpened(self):
+        return self.cap.isOpened()
+
+    @property
+    def queued(self):
+        return self.frames.qsize()
+
+    @property
+    def stride(self):
+        return self.cap.stride
+
+    @stride.setter
+    def stride(self, stride):
+        self.cap.stride = stride  # frames already queued keep the old stride
+
+    def stats(self):
+        '''Frames decoded, dropped for newer ones (latest=True) and waiting in the queue.'''
+        return dict(decoded=self.decoded, dropped=self.dropped, queued=self.queued)
+
+    def release(self):
+        self.running = False
+        try:
+            while True:
+                self.frames.get_nowait()
+        except queue.Empty:
+            pass
+        self.thread.join()
+        if hasattr(self.cap, 'release'):
+            self.cap.release()
+
+
+classes = dict(chess=Chess, book=Book, cube=Cube, scene=Scene)
 
 presets = dict(
     empty = 'synth:',
@@ -161,9 +364,15 @@ presets = dict(
 )
 
 
-def create_capture(source = 0, fallback = presets['chess']):
-    '''source: <int> or '<int>|<filename>|synth [:<param_name>=<value> [:...]]'
+def create_capture(source = 0, fallback = presets['chess'], prefetch = 0, latest = False, stride = None):
+    '''source: <int> or '<int>|<filename>|synth|ring [:<param_name>=<value> [:...]]'
+    prefetch: decode up to that many frames ahead on a background thread
+    latest: prefetch keeping only the newest frame (live cameras)
+    stride: return only every stride-th frame, see StrideCapture
+    A capture object opened by the caller is taken as it is and only wrapped.
     '''
+    if hasattr(source, 'read'):
+        return wrap_capture(source, prefetch, latest, stride)
     source = str(source).strip()
 
     # Win32: handle drive letter ('c:', ...)
@@ -174,23 +383,41 @@ def create_capture(source = 0, fallback = presets['chess']):
     source = chunks[0]
     try: source = int(source)
     except ValueError: pass
-    params = dict( s.split('=') for s in chunks[1:] )
+    params = dict( s.split('=') for s in chunks[1:] if s )
 
     cap = None
     if source == 'synth':
         Class = classes.get(params.get('class', None), VideoSynthBase)
         try: cap = Class(**params)
         except: pass
+    elif source == 'ring':
+        from framering import RingCapture  # Python 3.8+
+        try: cap = RingCapture(params.get('name', 'frames'), latest=latest, timeout=float(params.get('timeout', 5)))
+        except OSError: pass
+        # the frames are views of the shared ring, read ahead they could be overwritten
+        prefetch, latest = 0, False
     else:
         cap = cv.VideoCapture(source)
         if 'size' in params:
             w, h = map(int, params['size'].split('x'))
             cap.set(cv.CAP_PROP_FRAME_WIDTH, w)
             cap.set(cv.CAP_PROP_FRAME_HEIGHT, h)
+        if 'start' in params:
+            cap.set(cv.CAP_PROP_POS_FRAMES, int(params['start']))
     if cap is None or not cap.isOpened():
-        print('Warning: unable to open video source: ', source)
+        # on stderr, stdout may carry the records of a headless run
+        print('Warning: unable to open video source: ', source, file=sys.stderr)
         if fallback is not None:
-            return create_capture(fallback, None)
+            return create_capture(fallback, None, prefetch, latest, stride)
+    return wrap_capture(cap, prefetch, latest, stride)
+
+
+def wrap_capture(cap, prefetch = 0, latest = False, stride = None):
+    '''An open capture read through StrideCapture and PrefetchCapture as create_capture sets them.'''
+    if cap is not None and cap.isOpened() and stride is not None:
+        cap = StrideCapture(cap, stride)
+    if cap is not None and cap.isOpened() and (prefetch > 0 or latest):
+        cap = PrefetchCapture(cap, prefetch, latest)
     return cap
 
 if __name__ == '__main__':
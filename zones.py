@@ -0,0 +1,215 @@
+#!/usr/bin/env python
+
+'''
+Zone rasters for the trackers.
+
+A zone raster is an int8 label image with one entry per pixel:
+    1  - danger zone
+    2  - warning zone
+   -1  - free zone
+    0  - outside every zone
+
+The labels are identical to testing every pixel with
+cv2.pointPolygonTest(points, (x, y), False) > 0 in the order
+danger, warning, free, but the image is filled with cv2.fillPoly and
+only the pixels next to the polygon outlines are tested exactly.
+
+load_zone_raster keeps built rasters in an on-disk .npy cache keyed by
+the polygons and the frame size and hands them out memory mapped, so
+every tracker process on one box shares a single read-only copy.
+The cache directory is $VEHWARE_ZONE_CACHE or <tmp>/vehware_zones.
+'''
+
+# Python 2/3 compatibility
+from __future__ import print_function
+
+import numpy as np
+import cv2 as cv
+
+# built-in modules
+import os
+import hashlib
+import tempfile
+
+DANGER = 1
+WARNING = 2
+FREE = -1
+NONE = 0
+
+# zone names on the command line, none is outside every polygon
+NAMES = dict(danger=DANGER, warning=WARNING, free=FREE, none=NONE)
+
+# bump when the raster layout or labelling rules change
+CACHE_VERSION = 1
+
+# Zone polygons of every camera position, in 1280x720 frame coordinates.
+# Each element represents the corner of a polygon.
+PROFILES = dict(
+    # front camera, wide zones (trackerFront.py)
+    front = dict(
+        danger = [[200, 800], [281, 470], [447, 332], [558, 230], [680,230], [871, 352], [978, 480], [1059, 574], [1090, 660], [1090, 800]],
+        warning = [[0, 800], [200, 415], [500, 200], [728, 200], [870, 245],  [1280, 720]],
+        free = [[0, 718], [13, 466], [238, 576], [338, 604], [452, 625], [613, 636], [718, 634], [821, 617],
+                [948, 580], [1023, 551], [1147, 481], [1180, 447], [1275, 715]]),
+    # front camera, zones close to the bumper (lk_track.py, front_lk.py)
+    front_near = dict(
+        danger = [[200, 800], [276, 677], [400, 600], [593, 546], [918, 600], [1000, 677], [1065, 795]],
+        warning = [[0, 800], [198, 523], [297, 381], [589, 310], [969, 373], [1058, 499], [1280, 720], [1066, 795],
+                   [1001, 677], [919, 600], [594, 546], [401, 600], [277, 677], [201, 800]],
+        free = [[0, 718], [13, 466], [238, 576], [338, 604], [452, 625], [613, 636], [718, 634], [821, 617],
+                [948, 580], [1023, 551], [1147, 481], [1180, 447], [1275, 715]]),
+    # side camera (trackerSide.py, trackerAll.py)
+    side = dict(
+        danger = [[13,466], [238,576], [338,604], [452,625], [613,636], [718,634], [821,617], [948,580], [1023,551],[1147,481],[1180,447],[1170,360], [1028,365], [925,366], [738,366], [508,376], [318,366], [148,359], [88,355], [19,378] ],
+        warning = [[1170,360], [1028,365], [925,366], [738,366], [508,376], [318,366], [148,359], [88,355], [159,243], [267,222], [342,202], [559,196], [692,212], [829,226], [959,255], [1058,264], [1147,273], [1163,282]],
+        free = [[0,718], [13,466], [238,576], [338,604], [452,625], [613,636], [718,634], [821,617], [948,580], [1023,551] ,[1147,481], [1180,447],[1275,715]]),
+)
+
+
+def profile(name):
+    '''(danger, warning, free) polygons of a named zone profile.'''
+    p = PROFILES[name]
+    return p['danger'], p['warning'], p['free']
+
+
+def labels_of(names):
+    '''Labels of a comma separated list of zone NAMES, e.g. 'free,none'.'''
+    try:
+        return tuple(NAMES[name.strip()] for name in names.split(',') if name.strip())
+    except KeyError as e:
+        raise ValueError('unknown zone %s, expected some of %s' % (e, ', '.join(sorted(NAMES))))
+
+
+def inside_polygon(points, xs, ys):
+    '''Vectorized cv.pointPolygonTest(points, (x, y), False) > 0 for integer points.
+    Follows the OpenCV crossing test, so points on an edge count as outside.
+    '''
+    pts = np.asarray(points, np.int64).reshape(-1, 2)
+    xs = np.asarray(xs, np.int64)
+    ys = np.asarray(ys, np.int64)
+    counter = np.zeros(xs.shape, np.int64)
+    on_edge = np.zeros(xs.shape, bool)
+    v0 = pts[-1]
+    for v in pts:
+        skip = (((v0[1] <= ys) & (v[1] <= ys)) |
+                ((v0[1] > ys) & (v[1] > ys)) |
+                ((v0[0] < xs) & (v[0] < xs)))
+        on_edge |= skip & (ys == v[1]) & ((xs == v[0]) | ((ys == v0[1]) &
+                   (((v0[0] <= xs) & (xs <= v[0])) | ((v[0] <= xs) & (xs <= v0[0])))))
+        dist = (ys - v0[1]) * (v[0] - v0[0]) - (xs - v0[0]) * (v[1] - v0[1])
+        on_edge |= ~skip & (dist == 0)
+        if v[1] < v0[1]:
+            dist = -dist
+        counter += ~skip & (dist > 0)
+        v0 = v
+    return ~on_edge & (counter % 2 == 1)
+
+
+def polygon_mask(points, size):
+    '''Boolean (h, w) mask of the pixels strictly inside the polygon.'''
+    w, h = size
+    pts = np.asarray(points, np.int32).reshape(-1, 1, 2)
+    mask = np.zeros((h, w), np.uint8)
+    cv.fillPoly(mask, [pts], 1)
+
+    # fillPoly and pointPolygonTest disagree only on the outline, so the
+    # pixels within one pixel of an edge are decided by the exact test
+    band = np.zeros((h, w), np.uint8)
+    cv.polylines(band, [pts], True, 1, 3)
+    ys, xs = np.nonzero(band)
+    mask[ys, xs] = inside_polygon(pts, xs, ys)
+    return mask.view(bool)
+
+
+def build_zone_raster(danger, warning, free, size):
+    '''Builds the (h, w) int8 label image for the given zone polygons.
+    size is (width, height). Danger wins over warning, warning over free.
+    '''
+    w, h = size
+    labels = np.zeros((h, w), np.int8)
+    labels[polygon_mask(free, size)] = FREE
+    labels[polygon_mask(warning, size)] = WARNING
+    labels[polygon_mask(danger, size)] = DANGER
+    return labels
+
+
+def classify(labels, points):
+    '''Zone label of every (x, y) point, with the points clamped onto the raster.
+    Returns the labels and the clamped integer x and y coordinates.
+    '''
+    h, w = labels.shape
+    points = np.asarray(points, np.float32).reshape(-1, 2)
+    xs = np.clip(points[:, 0], 0, w - 1).astype(np.intp)
+    ys = np.clip(points[:, 1], 0, h - 1).astype(np.intp)
+    return labels[ys, xs], xs, ys
+
+
+def count_zones(labels, points, valid=None):
+    '''Number of points in each zone, indexed by label like numberOfZones:
+    counts[DANGER] and counts[WARNING]. Points outside the raster are not
+    counted and valid, if given, selects the points to count.
+    '''
+    h, w = labels.shape
+    points = np.asarray(points, np.float32).reshape(-1, 2)
+    if valid is not None:
+        points = points[np.ravel(valid)]
+    xs = points[:, 0].astype(np.intp)
+    ys = points[:, 1].astype(np.intp)
+    inside = (xs >= 0) & (xs < w) & (ys >= 0) & (ys < h)
+    found = labels[ys[inside], xs[inside]]
+    return np.bincount(found[found > 0], minlength=WARNING + 1)
+
+
+def zone_key(danger, warning, free, size):
+    '''Hex digest identifying the raster built from these polygons at this size.'''
+    h = hashlib.sha1()
+    h.update(np.int32([CACHE_VERSION, size[0], size[1]]).tobytes())
+    for points in (danger, warning, free):
+        pts = np.asarray(points, np.int32).reshape(-1, 2)
+        h.update(np.int32(len(pts)).tobytes())
+        h.update(pts.tobytes())
+    return h.hexdigest()
+
+
+def default_cache_dir():
+    return os.environ.get('VEHWARE_ZONE_CACHE', os.path.join(tempfile.gettempdir(), 'vehware_zones'))
+
+
+def load_zone_raster(danger, warning, free, size, cache_dir=None):
+    '''Same labels as build_zone_raster, served from the on-disk cache.
+    Returns a read-only memory-mapped array, or a private one if the cache
+    directory cannot be written.
+    '''
+    if cache_dir is None:
+        cache_dir = default_cache_dir()
+    w, h = size
+    path = os.path.join(cache_dir, 'zones_%s.npy' % zone_key(danger, warning, free, size))
+    try:
+        labels = np.load(path, mmap_mode='r')
+        if labels.shape == (h, w) and labels.dtype == np.int8:
+            return labels
+    except (IOError, OSError, ValueError):
+        pass
+
+    labels = build_zone_raster(danger, warning, free, size)
+    tmp_path = None
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        # write under a private name and rename, so concurrent trackers,
+        # threads of one process included, never map a half written file
+        fd, tmp_path = tempfile.mkstemp(suffix='.tmp', dir=cache_dir)
+        with os.fdopen(fd, 'wb') as f:
+            np.save(f, labels)
+        # mkstemp makes the file private, the cache is shared with the other users' trackers
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+        tmp_path = None
+        cached = np.load(path, mmap_mode='r')
+        if cached.shape == (h, w) and cached.dtype == np.int8:
+            return cached
+    except (IOError, OSError, ValueError):
+        pass
+    finally:
+        if tmp_path is not None and os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return labels